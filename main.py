@@ -6,15 +6,20 @@ Molvic Studio © 2024 | Basado en H.P. Lovecraft
 Motor: curses (stdlib) para TUI con colores
 """
 
-import curses, os, sys, json, time, random, signal
+import curses, os, sys, json, time, random, signal, asyncio, threading, re, hashlib, tempfile, zlib, struct, sqlite3
+import lzma
+from collections import deque
+from functools import lru_cache
+from operator import attrgetter
 from datetime import datetime
 from pathlib import Path
 from dataclasses import dataclass, field
-from typing import Dict, List, Optional, Any, Tuple
+from typing import Dict, List, Optional, Any, Tuple, Callable, Mapping
+from types import MappingProxyType
 from enum import Enum, auto
 
 VERSION, STUDIO = "3.0", "Molvic Studio © 2024"
-MAX_INV, PESO_MAX, VEL_BASE = 12, 20, 10
+MAX_INV, MAX_PILA, PESO_MAX, VEL_BASE = 12, 9, 20, 10
 XP_TABLA = {1:0, 2:100, 3:200, 4:350, 5:500, 6:800, 7:1200}
 SAVE_DIR = Path.home() / ".kadath_saves"
 
@@ -26,8 +31,9 @@ class GS(Enum):
 class Ciclo(Enum):
     DIA="DIA"; NOCHE="NOCHE"
 
-@dataclass
-class Item:
+@dataclass(frozen=True, eq=False, slots=True)
+class DefItem:
+    """Definición inmutable de un objeto, compartida por todos sus ejemplares."""
     id: str; nombre: str; tipo: str; desc: str = ""
     valor_c: int = 0; valor_v: int = 0; peso: int = 1
     usable: bool = False; cantidad: int = 1
@@ -37,56 +43,99 @@ class Item:
     # Armadura
     defensa: int = 0; resist: int = 0; bvel: int = 0
     # Consumible
-    efecto: Dict = field(default_factory=dict)
-    def to_dict(self): return {k:v for k,v in self.__dict__.items() if not callable(v)}
+    efecto: Mapping = field(default_factory=dict)
+    def __post_init__(self): object.__setattr__(self, "efecto", MappingProxyType(dict(self.efecto)))
+    def ejemplar(self) -> 'Item': return Item(self, self.dur, self.cantidad)
+    def __reduce__(self): return (_def_item, (self.id,))
+    def to_dict(self) -> dict:
+        return {"id": self.id, "nombre": self.nombre, "tipo": self.tipo, "desc": self.desc,
+                "valor_c": self.valor_c, "valor_v": self.valor_v, "peso": self.peso,
+                "usable": self.usable, "cantidad": self.cantidad,
+                "dmin": self.dmin, "dmax": self.dmax, "tdano": self.tdano, "dur": self.dur, "durmax": self.durmax,
+                "defensa": self.defensa, "resist": self.resist, "bvel": self.bvel, "efecto": dict(self.efecto)}
+
+@dataclass(slots=True)
+class Item:
+    """Ejemplar de un objeto: solo el estado mutable; el resto se lee de su DefItem."""
+    base: DefItem; dur: int = -1; cantidad: int = 1
+    def to_dict(self) -> dict:
+        d = self.base.to_dict(); d["dur"] = self.dur; d["cantidad"] = self.cantidad
+        return d
+
+# Campos de la definición como propiedades de clase: sin __dict__ ni __getattr__ por acceso
+for _k in DefItem.__dataclass_fields__:
+    if _k not in Item.__slots__: setattr(Item, _k, property(attrgetter("base." + _k)))
+del _k
 
-@dataclass  
+@dataclass(slots=True)
 class Enemy:
     id: str; nombre: str; vida: int; vidamax: int
     dmin: int; dmax: int; tdano: str; defensa: int
     vel: int; xp: int; oro_min: int; oro_max: int
     loot: List[Tuple[str,float]] = field(default_factory=list)
     jefe: bool = False; estados: List[str] = field(default_factory=list)
+    def nuevo(self) -> 'Enemy':
+        """Copia para un combate; el loot es de solo lectura y se comparte."""
+        return Enemy(self.id, self.nombre, self.vida, self.vidamax, self.dmin, self.dmax, self.tdano,
+                     self.defensa, self.vel, self.xp, self.oro_min, self.oro_max, self.loot,
+                     self.jefe, list(self.estados))
+    def to_dict(self) -> dict:
+        return {"id": self.id, "nombre": self.nombre, "vida": self.vida, "vidamax": self.vidamax,
+                "dmin": self.dmin, "dmax": self.dmax, "tdano": self.tdano, "defensa": self.defensa,
+                "vel": self.vel, "xp": self.xp, "oro_min": self.oro_min, "oro_max": self.oro_max,
+                "loot": [list(l) for l in self.loot], "jefe": self.jefe, "estados": list(self.estados)}
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Quest:
     id: str; titulo: str; giver: str; zona: str; desc: str
     objetivo: Dict; recompensa: Dict
     activa: bool = False; completada: bool = False
+    def to_dict(self) -> dict:
+        return {"id": self.id, "titulo": self.titulo, "giver": self.giver, "zona": self.zona,
+                "desc": self.desc, "objetivo": dict(self.objetivo), "recompensa": dict(self.recompensa),
+                "activa": self.activa, "completada": self.completada}
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # DATOS DEL JUEGO
 # ═══════════════════════════════════════════════════════════════════════════════
 ARMAS = {
-    "punos": Item("punos","Puños","ARMA","Tus manos",0,0,0,dmin=3,dmax=8),
-    "daga_onirica": Item("daga_onirica","Daga Onírica","ARMA","Hoja de sueños",80,32,1,dmin=8,dmax=15,tdano="ONIRICO",dur=10,durmax=10),
-    "espada_sueno": Item("espada_sueno","Espada del Sueño","ARMA","Forjada en Celephaïs",200,80,2,dmin=15,dmax=25,dur=10,durmax=10),
-    "cetro_ngranek": Item("cetro_ngranek","Cetro de Ngranek","ARMA","Poder ancestral",300,120,2,dmin=20,dmax=35,tdano="MAGICO",dur=8,durmax=8),
+    "punos": DefItem("punos","Puños","ARMA","Tus manos",0,0,0,dmin=3,dmax=8),
+    "daga_onirica": DefItem("daga_onirica","Daga Onírica","ARMA","Hoja de sueños",80,32,1,dmin=8,dmax=15,tdano="ONIRICO",dur=10,durmax=10),
+    "espada_sueno": DefItem("espada_sueno","Espada del Sueño","ARMA","Forjada en Celephaïs",200,80,2,dmin=15,dmax=25,dur=10,durmax=10),
+    "cetro_ngranek": DefItem("cetro_ngranek","Cetro de Ngranek","ARMA","Poder ancestral",300,120,2,dmin=20,dmax=35,tdano="MAGICO",dur=8,durmax=8),
 }
 
 ARMADURAS = {
-    "sin_armadura": Item("sin_armadura","Sin armadura","ARMADURA","",0,0,0),
-    "ropas_viajero": Item("ropas_viajero","Ropas de Viajero","ARMADURA","Cómodas",40,16,1,defensa=2,bvel=1),
-    "capa_niebla": Item("capa_niebla","Capa de Niebla","ARMADURA","Etérea",120,48,1,defensa=5,resist=3,bvel=2),
-    "armadura_gato": Item("armadura_gato","Armadura de Gato","ARMADURA","Bendecida",150,60,2,defensa=4,resist=5),
+    "sin_armadura": DefItem("sin_armadura","Sin armadura","ARMADURA","",0,0,0),
+    "ropas_viajero": DefItem("ropas_viajero","Ropas de Viajero","ARMADURA","Cómodas",40,16,1,defensa=2,bvel=1),
+    "capa_niebla": DefItem("capa_niebla","Capa de Niebla","ARMADURA","Etérea",120,48,1,defensa=5,resist=3,bvel=2),
+    "armadura_gato": DefItem("armadura_gato","Armadura de Gato","ARMADURA","Bendecida",150,60,2,defensa=4,resist=5),
 }
 
 CONSUMIBLES = {
-    "pocion_cordura": Item("pocion_cordura","Poción de Cordura","CONSUMIBLE","Calma la mente",30,12,1,usable=True,efecto={"cordura":25}),
-    "balsamo_onirico": Item("balsamo_onirico","Bálsamo Onírico","CONSUMIBLE","Sana heridas",25,10,1,usable=True,efecto={"vida":30}),
-    "elixir_voluntad": Item("elixir_voluntad","Elixir de Voluntad","CONSUMIBLE","Fortalece",35,14,1,usable=True,efecto={"voluntad":20}),
-    "pan_gatos": Item("pan_gatos","Pan de los Gatos","CONSUMIBLE","Delicioso",15,6,1,usable=True,efecto={"vida":10,"cordura":5}),
+    "pocion_cordura": DefItem("pocion_cordura","Poción de Cordura","CONSUMIBLE","Calma la mente",30,12,1,usable=True,efecto={"cordura":25}),
+    "balsamo_onirico": DefItem("balsamo_onirico","Bálsamo Onírico","CONSUMIBLE","Sana heridas",25,10,1,usable=True,efecto={"vida":30}),
+    "elixir_voluntad": DefItem("elixir_voluntad","Elixir de Voluntad","CONSUMIBLE","Fortalece",35,14,1,usable=True,efecto={"voluntad":20}),
+    "pan_gatos": DefItem("pan_gatos","Pan de los Gatos","CONSUMIBLE","Delicioso",15,6,1,usable=True,efecto={"vida":10,"cordura":5}),
 }
 
 MISION_ITEMS = {
-    "piedra_comun": Item("piedra_comun","Piedra Común","MISION","Los Zoog la valoran"),
-    "gatito_onirico": Item("gatito_onirico","Gatito Onírico","MISION","Perdido en el bosque"),
-    "trofeo_ghast": Item("trofeo_ghast","Trofeo de Ghast","TROFEO","Colmillo de bestia",0,50,1),
-    "mapa_frag": Item("mapa_frag","Fragmento del Mapa","MISION","Parte del mapa a Kadath"),
-    "llave_catacumbas": Item("llave_catacumbas","Llave Catacumbas","CLAVE","Abre el paso"),
-    "pergamino": Item("pergamino","Pergamino Antiguos","MISION","Texto pre-humano"),
+    "piedra_comun": DefItem("piedra_comun","Piedra Común","MISION","Los Zoog la valoran"),
+    "gatito_onirico": DefItem("gatito_onirico","Gatito Onírico","MISION","Perdido en el bosque"),
+    "trofeo_ghast": DefItem("trofeo_ghast","Trofeo de Ghast","TROFEO","Colmillo de bestia",0,50,1),
+    "mapa_frag": DefItem("mapa_frag","Fragmento del Mapa","MISION","Parte del mapa a Kadath"),
+    "llave_catacumbas": DefItem("llave_catacumbas","Llave Catacumbas","CLAVE","Abre el paso"),
+    "pergamino": DefItem("pergamino","Pergamino Antiguos","MISION","Texto pre-humano"),
 }
 
+DEF_ITEMS = {**ARMAS, **ARMADURAS, **CONSUMIBLES, **MISION_ITEMS}
+
+def _def_item(iid: str) -> DefItem: return DEF_ITEMS[iid]
+
+def nuevo_item(iid: str) -> Optional[Item]:
+    d = DEF_ITEMS.get(iid)
+    return d.ejemplar() if d else None
+
 ENEMIGOS = {
     "zoog": Enemy("zoog","Zoog Traicionero",10,10,3,8,"FISICO",0,15,22,2,8,[("pan_gatos",0.3)]),
     "ghul": Enemy("ghul","Ghul Carroñero",35,35,8,15,"FISICO",2,8,47,5,15,[("trofeo_ghast",0.4)]),
@@ -253,6 +302,120 @@ MEJORAS = [
     ("vel_2", "+2 Velocidad"),
 ]
 
+# ═══════════════════════════════════════════════════════════════════════════════
+# EVENTOS
+# ═══════════════════════════════════════════════════════════════════════════════
+@dataclass
+class ItemObtenido:
+    item: Item
+
+@dataclass
+class EnemigoDerrotado:
+    enemigo: Enemy; xp: int; oro: int
+
+@dataclass
+class ZonaEntrada:
+    zona: str; nueva: bool
+
+@dataclass
+class StatCambiado:
+    stat: str; antes: int; ahora: int
+
+class BusEventos:
+    """Suscriptores indexados por tipo de evento: publicar solo llama a los interesados."""
+    def __init__(self):
+        self.subs: Dict[type, List[Callable[[Any], None]]] = {}
+        self.conteo: Dict[str, int] = {}
+    
+    def suscribir(self, tipo: type, fn: Callable[[Any], None]):
+        self.subs.setdefault(tipo, []).append(fn)
+    
+    def publicar(self, ev):
+        n = type(ev).__name__
+        self.conteo[n] = self.conteo.get(n, 0) + 1
+        for fn in self.subs.get(type(ev), ()): fn(ev)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# INVENTARIO
+# ═══════════════════════════════════════════════════════════════════════════════
+class Inventario:
+    """Ranuras en orden con índice id→ranuras y vistas por tipo, mantenidos al añadir y quitar.
+    Lo que no es equipo se apila hasta MAX_PILA; cada arma o armadura ocupa su ranura (dur propia)."""
+    VISTAS = {"CONSUMIBLE": "consumibles", "ARMA": "equipo", "ARMADURA": "equipo",
+              "MISION": "mision", "CLAVE": "mision", "TROFEO": "mision"}
+    
+    def __init__(self, items=()):
+        self.ranuras: List[Item] = []
+        self.indice: Dict[str, List[Item]] = {}
+        self.vistas: Dict[str, List[Item]] = {"consumibles": [], "equipo": [], "mision": []}
+        for it in items: self.anadir(it, forzar=True)
+    
+    @staticmethod
+    def apilable(it) -> bool: return it.tipo not in ("ARMA", "ARMADURA")
+    
+    def __len__(self): return len(self.ranuras)
+    def __iter__(self): return iter(self.ranuras)
+    def __getitem__(self, i): return self.ranuras[i]
+    def __contains__(self, iid): return iid in self.indice
+    
+    @property
+    def consumibles(self) -> List[Item]: return self.vistas["consumibles"]
+    @property
+    def equipo(self) -> List[Item]: return self.vistas["equipo"]
+    @property
+    def mision(self) -> List[Item]: return self.vistas["mision"]
+    
+    def cuenta(self, iid: str) -> int:
+        return sum(r.cantidad for r in self.indice.get(iid, ()))
+    
+    def _pila(self, it) -> Optional[Item]:
+        if not self.apilable(it): return None
+        return next((r for r in self.indice.get(it.id, ()) if r.cantidad < MAX_PILA), None)
+    
+    def cabe(self, it) -> bool:
+        return len(self.ranuras) < MAX_INV or self._pila(it) is not None
+    
+    def anadir(self, it: Item, forzar=False) -> bool:
+        pila = self._pila(it)
+        if pila is not None and pila.cantidad + it.cantidad <= MAX_PILA:
+            pila.cantidad += it.cantidad
+            return True
+        if len(self.ranuras) >= MAX_INV and not forzar: return False
+        self.ranuras.append(it)
+        self.indice.setdefault(it.id, []).append(it)
+        v = self.VISTAS.get(it.tipo)
+        if v: self.vistas[v].append(it)
+        return True
+    
+    def _soltar(self, r: Item):
+        self.ranuras.pop(next(i for i, x in enumerate(self.ranuras) if x is r))
+        en = self.indice[r.id]
+        en.pop(next(i for i, x in enumerate(en) if x is r))
+        if not en: del self.indice[r.id]
+        v = self.VISTAS.get(r.tipo)
+        if v: self.vistas[v].pop(next(i for i, x in enumerate(self.vistas[v]) if x is r))
+    
+    def _una(self, r: Item) -> Item:
+        if r.cantidad > 1:
+            r.cantidad -= 1
+            return Item(r.base, r.dur, 1)
+        self._soltar(r)
+        return r
+    
+    def sacar(self, idx: int) -> Item:
+        """Quita una unidad de la ranura idx y la devuelve como ejemplar suelto."""
+        return self._una(self.ranuras[idx])
+    
+    def quitar(self, iid: str) -> bool:
+        en = self.indice.get(iid)
+        if not en: return False
+        self._una(en[-1])
+        return True
+    
+    def ids(self) -> List[str]:
+        """Una entrada por unidad, como en el formato de guardado."""
+        return [r.id for r in self.ranuras for _ in range(r.cantidad)]
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # CLASE PLAYER
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -269,9 +432,9 @@ class Player:
         self.bonus_dano = 0.0
         self.bonus_resist = 0.0
         
-        self.arma = Item("punos","Puños","ARMA",dmin=3,dmax=8)
-        self.armadura = Item("sin_armadura","Sin armadura","ARMADURA")
-        self.inventario: List[Item] = [Item("piedra_comun","Piedra Común","MISION")]
+        self.arma = ARMAS["punos"].ejemplar()
+        self.armadura = ARMADURAS["sin_armadura"].ejemplar()
+        self.inventario = Inventario([MISION_ITEMS["piedra_comun"].ejemplar()])
         self.habilidades: List[str] = []
         self.estados: Dict[str,int] = {}
         
@@ -293,6 +456,11 @@ class Player:
         self.tiempo = 0
         self.eventos: List[str] = []
         self.decisiones: List[str] = []
+        self.bus: Optional[BusEventos] = None
+        self.extra: Dict[str, Any] = {}   # campos de otras versiones que este juego no usa
+    
+    def emitir(self, ev):
+        if self.bus: self.bus.publicar(ev)
     
     def vel_efectiva(self) -> int:
         v = self.vel_base + self.nivel
@@ -321,29 +489,32 @@ class Player:
                     self.habilidades.append(h[0])
     
     def mod_stat(self, stat: str, val: int):
+        antes = getattr(self, stat, None)
         if stat == "vida": self.vida = max(0, min(self.vida_max, self.vida + val))
         elif stat == "cordura": self.cordura = max(0, min(self.cordura_max, self.cordura + val))
         elif stat == "voluntad": self.voluntad = max(0, min(self.voluntad_max, self.voluntad + val))
         elif stat == "oro": self.oro = max(0, min(9999, self.oro + val))
         elif stat == "reputacion": self.reputacion = max(-100, min(100, self.reputacion + val))
+        if antes is not None and getattr(self, stat) != antes:
+            self.emitir(StatCambiado(stat, antes, getattr(self, stat)))
     
     def tiene_item(self, iid: str) -> bool:
-        return any(i.id == iid for i in self.inventario)
+        return iid in self.inventario
     
     def add_item(self, item: Item) -> bool:
-        if len(self.inventario) >= MAX_INV: return False
-        self.inventario.append(item)
+        if not self.inventario.anadir(item): return False
+        self.emitir(ItemObtenido(item))
         return True
     
+    def ir_a(self, zona: str):
+        self.zona = zona
+        self.emitir(ZonaEntrada(zona, zona not in self.zonas_visitadas))
+    
     def rem_item(self, iid: str) -> bool:
-        for i, it in enumerate(self.inventario):
-            if it.id == iid:
-                self.inventario.pop(i)
-                return True
-        return False
+        return self.inventario.quitar(iid)
     
     def to_dict(self) -> dict:
-        return {
+        d = {
             "vida": self.vida, "vida_max": self.vida_max,
             "cordura": self.cordura, "cordura_max": self.cordura_max,
             "voluntad": self.voluntad, "voluntad_max": self.voluntad_max,
@@ -352,7 +523,7 @@ class Player:
             "bonus_dano": self.bonus_dano, "bonus_resist": self.bonus_resist,
             "arma": self.arma.id if self.arma else "punos",
             "armadura": self.armadura.id if self.armadura else "sin_armadura",
-            "inventario": [i.id for i in self.inventario],
+            "inventario": self.inventario.ids(),
             "habilidades": self.habilidades, "flags": self.flags,
             "mapa_frags": self.mapa_frags, "muertes": self.muertes,
             "quests_activas": self.quests_activas, "quests_completas": self.quests_completas,
@@ -362,6 +533,8 @@ class Player:
             "turno": self.turno, "tiempo": self.tiempo,
             "eventos": self.eventos, "decisiones": self.decisiones,
         }
+        if self.extra: d["extra"] = self.extra
+        return d
     
     @classmethod
     def from_dict(cls, d: dict) -> 'Player':
@@ -371,18 +544,10 @@ class Player:
                   "mapa_frags","muertes","descansos","turno","tiempo"]:
             if k in d: setattr(p, k, d[k])
         
-        if d.get("arma") in ARMAS:
-            import copy; p.arma = copy.deepcopy(ARMAS[d["arma"]])
-        if d.get("armadura") in ARMADURAS:
-            import copy; p.armadura = copy.deepcopy(ARMADURAS[d["armadura"]])
+        if d.get("arma") in ARMAS: p.arma = ARMAS[d["arma"]].ejemplar()
+        if d.get("armadura") in ARMADURAS: p.armadura = ARMADURAS[d["armadura"]].ejemplar()
         
-        p.inventario = []
-        for iid in d.get("inventario", []):
-            import copy
-            if iid in CONSUMIBLES: p.inventario.append(copy.deepcopy(CONSUMIBLES[iid]))
-            elif iid in MISION_ITEMS: p.inventario.append(copy.deepcopy(MISION_ITEMS[iid]))
-            elif iid in ARMAS: p.inventario.append(copy.deepcopy(ARMAS[iid]))
-            elif iid in ARMADURAS: p.inventario.append(copy.deepcopy(ARMADURAS[iid]))
+        p.inventario = Inventario(DEF_ITEMS[iid].ejemplar() for iid in d.get("inventario", []) if iid in DEF_ITEMS)
         
         p.habilidades = d.get("habilidades", [])
         p.flags = d.get("flags", p.flags)
@@ -395,8 +560,200 @@ class Player:
         p.ciclo = Ciclo(d.get("ciclo", "DIA"))
         p.eventos = d.get("eventos", [])
         p.decisiones = d.get("decisiones", [])
+        p.extra = d.get("extra", {})
         return p
 
+# ═══════════════════════════════════════════════════════════════════════════════
+# MAQUETACIÓN DE TEXTO
+# ═══════════════════════════════════════════════════════════════════════════════
+@lru_cache(maxsize=2048)
+def envolver(texto: str, ancho: int, justificar: bool = False) -> Tuple[str, ...]:
+    """Parte el texto en líneas de como mucho `ancho` columnas, respetando párrafos.
+    Memoizado por (texto, ancho): redibujar la misma pantalla es solo una búsqueda."""
+    ancho = max(1, ancho)
+    out: List[str] = []
+    for parrafo in texto.splitlines() or [""]:
+        palabras = []
+        for w in parrafo.split():
+            while len(w) > ancho:
+                palabras.append(w[:ancho]); w = w[ancho:]
+            palabras.append(w)
+        if not palabras:
+            out.append(""); continue
+        linea: List[str] = []; n = 0
+        for w in palabras:
+            if linea and n + 1 + len(w) > ancho:
+                out.append(_justificar(linea, ancho) if justificar else " ".join(linea))
+                linea, n = [], 0
+            n += len(w) + (1 if linea else 0)
+            linea.append(w)
+        out.append(" ".join(linea))
+    return tuple(out)
+
+def _justificar(palabras: List[str], ancho: int) -> str:
+    if len(palabras) == 1: return palabras[0]
+    huecos = len(palabras) - 1
+    extra = ancho - sum(len(w) for w in palabras)
+    base, resto = divmod(extra, huecos)
+    return "".join(w + " "*(base + (1 if i < resto else 0)) for i, w in enumerate(palabras[:-1])) + palabras[-1]
+
+def paginar(lineas, alto: int) -> List[Tuple[str, ...]]:
+    alto = max(1, alto)
+    lineas = tuple(lineas)
+    return [lineas[i:i+alto] for i in range(0, len(lineas), alto)] or [()]
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# TEMA DE COLORES
+# ═══════════════════════════════════════════════════════════════════════════════
+# Par de color por rol semántico; los pares 1-6 son los que usa ui.col(n)
+ROLES = {"vida": 1, "cordura": 2, "voluntad": 3, "oro": 4, "titulo": 4, "peligro": 5, "info": 6}
+PALETA_8 = {1: curses.COLOR_GREEN, 2: curses.COLOR_CYAN, 3: curses.COLOR_MAGENTA,
+            4: curses.COLOR_YELLOW, 5: curses.COLOR_RED, 6: curses.COLOR_BLUE}
+PALETA_256 = {1: 71, 2: 73, 3: 140, 4: 178, 5: 160, 6: 68}
+# Sin color: cada par se degrada a un atributo que se distinga en monocromo
+PALETA_MONO = {1: 0, 2: 0, 3: 0, 4: curses.A_BOLD, 5: curses.A_STANDOUT, 6: curses.A_DIM}
+
+class Tema:
+    """Detecta las capacidades del terminal una vez y precalcula los atributos."""
+    def __init__(self, cols: List[int], colores: int = 0, truecolor: bool = False,
+                 cambia_color: bool = False):
+        self.cols = cols
+        self.colores, self.truecolor, self.cambia_color = colores, truecolor, cambia_color
+        self.roles = {r: cols[n] for r, n in ROLES.items()}
+    
+    @classmethod
+    def detectar(cls) -> 'Tema':
+        mono = [0] + [PALETA_MONO[n] for n in range(1, 7)]
+        try:
+            if not curses.has_colors(): return cls(mono)
+            curses.start_color()
+            fondo = -1
+            try: curses.use_default_colors()
+            except curses.error: fondo = curses.COLOR_BLACK
+            n = curses.COLORS
+            paleta = PALETA_256 if n >= 256 else PALETA_8
+            for par, c in paleta.items():
+                curses.init_pair(par, c, fondo)
+            cols = [0] + [curses.color_pair(par) for par in range(1, 7)]
+            return cls(cols, n, os.environ.get("COLORTERM", "") in ("truecolor", "24bit"),
+                       curses.can_change_color())
+        except curses.error:
+            return cls(mono)
+    
+    @classmethod
+    def virtual(cls) -> 'Tema':
+        # Mismo codificado que curses.color_pair, para que RenderANSI recupere el par
+        return cls([n << 8 for n in range(7)], 256)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# ENTRADA: ATAJOS, COLA DE EVENTOS Y MACROS
+# ═══════════════════════════════════════════════════════════════════════════════
+# Tecla -> acción por contexto. Se puede ampliar con ~/.kadath_saves/teclas.json:
+# {"explorar": {"e": "explorar", "KEY_F8": "mapa"}}
+ATAJOS = {
+    "explorar": {"1": "explorar", "2": "viajar", "3": "descansar", "4": "tienda", "5": "hablar",
+                 "iI": "inventario", "mM": "mapa", "pP": "pausa", "qQ": "quests", "?": "ayuda",
+                 "KEY_F3": "debug"},
+    "combate": {"1": "atacar", "2": "objeto", "3": "esquivar", "4": "huir", "5": "conjuro"},
+}
+MACRO_GRABAR, MACRO_REPRODUCIR, MACRO_EXPLORAR = curses.KEY_F5, curses.KEY_F6, curses.KEY_F7
+MACRO_MAX_REPETICIONES = 30
+
+def _teclas(spec: str) -> List[int]:
+    if spec.startswith("KEY_"): return [getattr(curses, spec)]
+    return [ord(c) for c in spec]
+
+@dataclass
+class Macro:
+    teclas: List[int]
+    repetir: int = 1
+    contexto: Optional[str] = None    # se corta al salir de este contexto
+    pos: int = 0
+
+class Entrada:
+    """Capa entre el juego y la UI: atajos semánticos, cola con marcas de tiempo y macros.
+    [F5] graba/para macro  [F6] la reproduce  [F7] explora hasta un encuentro."""
+    def __init__(self, ui: 'UI'):
+        self.ui = ui
+        self.cola: deque = deque()                  # (t, tecla) pendientes
+        self.historial: deque = deque(maxlen=256)   # (t, tecla) entregadas
+        self.contexto = ""
+        self.grabando: Optional[List[int]] = None
+        self.macro_grabada: List[int] = []
+        self.macro: Optional[Macro] = None
+        self.atajos: Dict[str, Dict[int, str]] = {}
+        self.cargar_atajos(ATAJOS)
+        try:
+            with open(SAVE_DIR / "teclas.json") as f:
+                self.cargar_atajos(json.load(f))
+        except (OSError, ValueError, AttributeError): pass
+    
+    def cargar_atajos(self, tabla: Dict[str, Dict[str, str]]):
+        for ctx, m in tabla.items():
+            dest = self.atajos.setdefault(ctx, {})
+            for spec, accion in m.items():
+                for k in _teclas(spec): dest[k] = accion
+    
+    def accion(self, ctx: str, k: int) -> Optional[str]:
+        return self.atajos.get(ctx, {}).get(k)
+    
+    def empujar(self, k: int):
+        self.cola.append((time.perf_counter(), k))
+    
+    def poll(self, ms: int = 0, consumir: bool = True) -> Optional[int]:
+        """Lectura no bloqueante: espera como mucho `ms` y devuelve None si no hay tecla.
+        Con consumir=False la tecla queda en cola para el siguiente leer()."""
+        if not self.cola:
+            k = self.ui._leer_timeout(max(0, ms))
+            if k == -1: return None
+            self.empujar(k)
+        if not consumir: return self.cola[0][1]
+        return self._entregar(self.cola.popleft()[1])
+    
+    def leer(self) -> int:
+        while True:
+            if self.cola: return self._entregar(self.cola.popleft()[1])
+            k = self._de_macro()
+            if k is not None: return self._entregar(k)
+            k = self.ui._getch()
+            if k == MACRO_GRABAR:
+                if self.grabando is None:
+                    self.grabando = []
+                    self.ui.toast("● Grabando macro (F5 para parar)", self.ui.rol("peligro"), 3)
+                else:
+                    self.macro_grabada, self.grabando = self.grabando, None
+                    self.ui.toast(f"Macro guardada: {len(self.macro_grabada)} teclas", self.ui.rol("info"))
+                self.ui.refresh()
+            elif k == MACRO_REPRODUCIR:
+                if self.macro_grabada: self.macro = Macro(list(self.macro_grabada))
+            elif k == MACRO_EXPLORAR:
+                # Solo en exploración: en otros contextos la tecla de explorar es otra acción
+                tecla = next((t for t, a in self.atajos.get("explorar", {}).items() if a == "explorar"), None)
+                if tecla is not None and self.contexto == "EXPLOR":
+                    self.macro = Macro([tecla], MACRO_MAX_REPETICIONES, self.contexto)
+            else:
+                if self.grabando is not None: self.grabando.append(k)
+                return self._entregar(k)
+    
+    def _de_macro(self) -> Optional[int]:
+        m = self.macro
+        if m is None: return None
+        if (m.contexto and m.contexto != self.contexto) or self.ui._tecla_disponible():
+            self.macro = None        # cambió el estado o el jugador tomó el control
+            return None
+        if m.pos >= len(m.teclas):
+            m.repetir -= 1
+            m.pos = 0
+            if m.repetir <= 0 or not m.teclas:
+                self.macro = None
+                return None
+        m.pos += 1
+        return m.teclas[m.pos - 1]
+    
+    def _entregar(self, k: int) -> int:
+        self.historial.append((time.perf_counter(), k))
+        return k
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # UI MANAGER
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -404,33 +761,82 @@ class UI:
     def __init__(self, scr):
         self.scr = scr
         self.my, self.mx = scr.getmaxyx()
-        self.colors = False
-        try:
-            curses.start_color()
-            curses.use_default_colors()
-            curses.init_pair(1, curses.COLOR_GREEN, -1)
-            curses.init_pair(2, curses.COLOR_CYAN, -1)
-            curses.init_pair(3, curses.COLOR_MAGENTA, -1)
-            curses.init_pair(4, curses.COLOR_YELLOW, -1)
-            curses.init_pair(5, curses.COLOR_RED, -1)
-            curses.init_pair(6, curses.COLOR_BLUE, -1)
-            self.colors = True
-        except: pass
-        curses.curs_set(0)
+        self.tema = Tema.detectar()
+        self.colors = self.tema.colores > 0
+        try: curses.curs_set(0)
+        except curses.error: pass
         scr.keypad(True)
+        self.pantalla = Pantalla(self.my, self.mx)   # copia en memoria para capturas
+        self._init_estado()
+        # Las UIs sin terminal (sesiones --servir, bancos, repeticiones) no graban: compartirían fichero
+        ruta = os.environ.get("KADATH_GRABAR")
+        if ruta: self.grabador = Grabador(ruta)
+    
+    def _init_estado(self):
+        # Contadores del overlay de depuración (KADATH_DEBUG=1 o F3 en exploración)
+        self.debug = os.environ.get("KADATH_DEBUG") == "1"
+        self.etiqueta = ""
+        self.extra = ""
+        self.save_ms = 0.0
+        self.n_addstr = self.n_bytes = 0
+        self.t_getch = 0.0
+        self._t0 = time.perf_counter()
+        self._pad = None
+        # Mensajes temporales y modo rápido (KADATH_RAPIDO=1 salta todas las pausas)
+        self.rapido = os.environ.get("KADATH_RAPIDO") == "1"
+        self.toasts: deque = deque()
+        self._toast_visible = False
+        self._fila_toast: Optional[tuple] = None
+        self.entrada = Entrada(self)
+        self.ultimo = {"addstr": 0, "bytes": 0, "frame_ms": 0.0, "getch_ms": 0.0}
+        self.grabador: Optional[Grabador] = None          # solo la UI curses (KADATH_GRABAR)
+        self.rec_teclas: Optional[GrabadorTeclas] = None   # lo crea Game.run si main() le pasa KADATH_TECLAS
+        # Redimensionado diferido al siguiente frame y layouts por tamaño de terminal
+        self.resize_pendiente = False
+        self._resize_avisado = False    # KEY_RESIZE se entrega una sola vez por redimensionado
+        self.relayouts = 0
+        self._layouts: Dict[tuple, Any] = {}
+    
+    def marcar_resize(self):
+        """Seguro desde un manejador de señal: solo anota; clear() aplica el cambio."""
+        self.resize_pendiente = True
+        self._resize_avisado = False
     
     def resize(self):
+        try:
+            tam = os.get_terminal_size(sys.__stdout__.fileno())
+            if curses.is_term_resized(tam.lines, tam.columns):
+                curses.resizeterm(tam.lines, tam.columns)
+        except (OSError, ValueError, curses.error): pass
         self.my, self.mx = self.scr.getmaxyx()
+        self.pantalla.redimensionar(self.my, self.mx)
+    
+    def layout(self, clave, calcular):
+        """Geometría precalculada por (filas, cols, clave); volver a un tamaño ya visto no recalcula."""
+        k = (self.my, self.mx, clave)
+        lay = self._layouts.get(k)
+        if lay is None:
+            if len(self._layouts) > 256: self._layouts.clear()
+            lay = self._layouts[k] = calcular()
+        return lay
     
     def addstr(self, y, x, s, attr=0) -> bool:
+        self.n_addstr += 1
+        self.n_bytes += len(s.encode("utf-8"))
+        return self._addstr(y, x, s, attr)
+    
+    def _addstr(self, y, x, s, attr=0) -> bool:
         try:
             if 0 <= y < self.my and 0 <= x < self.mx:
-                self.scr.addstr(y, x, s[:self.mx-x-1], attr)
+                s = s[:self.mx-x-1]
+                self.pantalla.escribir(y, x, s, attr)
+                self.scr.addstr(y, x, s, attr)
                 return True
         except: pass
         return False
     
-    def col(self, n): return curses.color_pair(n) if self.colors else 0
+    def col(self, n): return self.tema.cols[n]
+    def rol(self, nombre: str): return self.tema.roles[nombre]
     
     def barra(self, y, x, val, mx, w=10, c=1):
         try:
@@ -438,6 +844,14 @@ class UI:
             self.addstr(y, x, "[" + "█"*p + "░"*(w-p) + "]", self.col(c))
         except: pass
     
+    def parrafo(self, y, x, texto, attr=0, ancho=None, max_lineas=None, justificar=False) -> int:
+        """Dibuja texto envuelto al ancho disponible; devuelve la siguiente fila libre."""
+        lineas = envolver(texto, ancho or self.mx - x - 2, justificar)
+        for l in lineas[:max_lineas]:
+            self.addstr(y, x, l, attr)
+            y += 1
+        return y
+    
     def caja(self, y, x, h, w, titulo=""):
         try:
             self.addstr(y, x, "╔" + "═"*(w-2) + "╗")
@@ -448,10 +862,524 @@ class UI:
                 self.addstr(y, x+2, f" {titulo} ", self.col(4))
         except: pass
     
-    def clear(self): self.scr.clear()
-    def refresh(self): self.scr.refresh()
-    def getch(self): return self.scr.getch()
-    def wait(self): self.scr.getch()
+    def clear(self):
+        self._t0 = time.perf_counter()
+        self.t_getch = 0.0
+        if self.resize_pendiente:
+            self.resize_pendiente = self._resize_avisado = False
+            self.relayouts += 1
+            self.resize()
+        self._limpiar()
+    
+    def refresh(self):
+        ahora = time.perf_counter()
+        self.ultimo = {"addstr": self.n_addstr, "bytes": self.n_bytes,
+                       "frame_ms": (ahora - self._t0 - self.t_getch) * 1000,
+                       "getch_ms": self.t_getch * 1000}
+        t = self._toast_vigente()
+        if t: self._mostrar_toast(self.my-3, t[0], t[1])
+        if self.debug: self._overlay()
+        self._refrescar()
+        if self.grabador: self.grabador.frame(self.pantalla)
+        self.n_addstr = self.n_bytes = 0
+        self.t_getch = 0.0
+        self._t0 = time.perf_counter()
+    
+    def _overlay(self):
+        u = self.ultimo
+        txt = (f" {self.etiqueta} | frame {u['frame_ms']:.2f}ms | addstr {u['addstr']}"
+               f" | {u['bytes']} B | getch {u['getch_ms']:.0f}ms | save {self.save_ms:.1f}ms"
+               f" | relayout {self.relayouts} {self.extra}")
+        self._addstr(self.my-1, 0, txt.ljust(self.mx-1), curses.A_REVERSE)
+    
+    def getch(self):
+        while True:
+            k = self.entrada.leer()
+            if k != curses.KEY_F2:
+                if self.rec_teclas: self.rec_teclas.tecla(k)
+                return k
+            ruta = self.captura(SAVE_DIR / "capturas")
+            self.toast(f"Captura guardada: {ruta.name}.*" if ruta else "No se pudo guardar la captura",
+                       self.rol("info"))
+            self.refresh()
+    
+    def _getch(self):
+        t0 = time.perf_counter()
+        try:
+            if self.resize_pendiente and not self._resize_avisado:
+                self._resize_avisado = True
+                return curses.KEY_RESIZE
+            # Con un mensaje en pantalla se espera solo hasta que caduque
+            while self._toast_visible:
+                t = self._toast_vigente()
+                if t is None: break
+                k = self._leer_timeout(max(1, int((t[3] - time.perf_counter()) * 1000)))
+                if k != -1: return k
+                self._quitar_toast(self.my-3)
+                sig = self._toast_vigente()
+                if sig:
+                    self._mostrar_toast(self.my-3, sig[0], sig[1])
+                    self._refrescar()
+            while True:
+                k = self._leer()
+                if k != curses.KEY_RESIZE or self.scr is None: return k
+                if self.scr.getmaxyx() != (self.my, self.mx):
+                    self.resize_pendiente = self._resize_avisado = True
+                    return k
+                # eco del KEY_RESIZE que encola nuestro propio resizeterm
+        finally:
+            self.t_getch += time.perf_counter() - t0
+    
+    def toast(self, texto: str, attr: int = 0, dur: float = 1.5):
+        """Mensaje temporal no bloqueante: se dibuja en los próximos frames mientras la entrada sigue."""
+        self.toasts.append([texto, attr, dur, None])
+    
+    def _toast_vigente(self):
+        ahora = time.perf_counter()
+        while self.toasts:
+            t = self.toasts[0]
+            if t[3] is None: t[3] = ahora + t[2]
+            if t[3] > ahora: return t
+            self.toasts.popleft()
+        return None
+    
+    def pausa(self, seg: float, consumir: bool = True):
+        """Sustituye a time.sleep: mantiene la pantalla sin bloquear y cualquier tecla la salta.
+        Con consumir=False la tecla se entrega al siguiente getch."""
+        if self.rapido or seg <= 0: return
+        fin = time.perf_counter() + seg
+        while True:
+            restante = fin - time.perf_counter()
+            if restante <= 0: return
+            if self.entrada.poll(max(1, int(restante * 1000)), consumir) is not None: return
+    
+    def _limpiar(self):
+        self.scr.clear()
+        self.pantalla.limpiar()
+    
+    def _refrescar(self):
+        self.scr.noutrefresh()
+        if self._pad:
+            pad, args = self._pad
+            self._pad = None
+            try: pad.noutrefresh(*args)
+            except curses.error: pass
+        if self._toast_visible: self._win_toast.noutrefresh()
+        curses.doupdate()
+    
+    def _leer(self): return self.scr.getch()
+    
+    def _leer_timeout(self, ms: int):
+        self.scr.timeout(ms)
+        try: return self.scr.getch()
+        finally: self.scr.timeout(-1)
+    
+    def _tecla_disponible(self) -> bool:
+        k = self._leer_timeout(0)
+        if k == -1: return False
+        curses.ungetch(k)
+        return True
+    
+    def _mostrar_toast(self, y, texto, attr):
+        # Ventana propia: al caducar basta con repintar la línea de stdscr que tapaba
+        self._sombrear_toast(y, texto, attr)
+        try:
+            self._win_toast = curses.newwin(1, self.mx, y, 0)
+            self._win_toast.addstr(0, 2, texto[:self.mx-3], attr)
+        except curses.error:
+            self._toast_visible = False
+    
+    def _quitar_toast(self, y):
+        self._restaurar_toast(y)
+        try:
+            self.scr.touchline(y, 1)
+            self.scr.refresh()
+        except curses.error: pass
+    
+    def _sombrear_toast(self, y, texto, attr):
+        if 0 <= y < self.my:
+            # Se guarda la fila de debajo solo si no es ya el propio mensaje: un segundo
+            # refresh sin redibujar la guardaría y al caducar volvería a escribirlo
+            fila = (self.pantalla.chars[y], self.pantalla.attrs[y])
+            if not (self._toast_visible and fila == self._fila_toast):
+                self._bajo_toast = (fila[0][:], fila[1][:])
+            self.pantalla.escribir(y, 0, ("  " + texto)[:self.mx-1].ljust(self.mx), attr)
+            self._fila_toast = (self.pantalla.chars[y][:], self.pantalla.attrs[y][:])
+            self._toast_visible = True
+    
+    def _restaurar_toast(self, y):
+        self._toast_visible = False
+        if 0 <= y < self.my:
+            self.pantalla.chars[y], self.pantalla.attrs[y] = self._bajo_toast
+    
+    def wait(self): self.getch()
+    
+    def pad(self, alto: int, ancho: int):
+        return (curses.newpad(alto + 1, ancho + 1), Pantalla(alto + 1, ancho + 1))
+    
+    def pad_addstr(self, pad, y, x, s, attr=0):
+        if 0 <= y < pad[1].my and 0 <= x < pad[1].mx:
+            pad[1].escribir(y, x, s[:pad[1].mx-x], attr)
+        try: pad[0].addstr(y, x, s, attr)
+        except curses.error: pass
+    
+    def ver_pad(self, pad, py, px, y, x, h, w):
+        """Muestra solo la ventana visible del pad en el próximo refresh."""
+        h, w = min(h, self.my - y), min(w, self.mx - x)
+        if h > 0 and w > 0:
+            self._pad = (pad[0], (py, px, y, x, y + h - 1, x + w - 1))
+            self.pantalla.pegar(pad[1], py, px, y, x, h, w)
+    
+    def captura(self, directorio: Path) -> Optional[Path]:
+        """Guarda la pantalla actual como .txt, .ansi y .html; devuelve la ruta sin extensión."""
+        try:
+            directorio.mkdir(parents=True, exist_ok=True)
+            base = directorio / datetime.now().strftime("kadath_%Y%m%d_%H%M%S_%f")
+            exportar_pantalla(self.pantalla, base)
+            return base
+        except OSError: return None
+    
+    def cerrar(self):
+        if self.grabador:
+            self.grabador.cerrar()
+            self.grabador = None
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# UI VIRTUAL (sin terminal: tests, bots, servidores)
+# ═══════════════════════════════════════════════════════════════════════════════
+class EntradaAgotada(Exception):
+    pass
+
+class Pantalla:
+    """Buffer de celdas en memoria: un carácter y un atributo por celda."""
+    def __init__(self, my: int = 24, mx: int = 80):
+        self.redimensionar(my, mx)
+    
+    def redimensionar(self, my: int, mx: int):
+        self.my, self.mx = my, mx
+        self.chars = [[" "]*mx for _ in range(my)]
+        self.attrs = [[0]*mx for _ in range(my)]
+    
+    def limpiar(self):
+        for fila in self.chars: fila[:] = " "*self.mx
+        for fila in self.attrs: fila[:] = [0]*self.mx
+    
+    def escribir(self, y: int, x: int, s: str, attr: int = 0):
+        n = len(s)
+        self.chars[y][x:x+n] = s
+        self.attrs[y][x:x+n] = [attr]*n
+    
+    def linea(self, y: int) -> str: return "".join(self.chars[y])
+    def texto(self) -> str: return "\n".join(self.linea(y).rstrip() for y in range(self.my))
+    
+    def pegar(self, otra: 'Pantalla', py, px, y, x, h, w):
+        h = max(0, min(h, self.my - y, otra.my - py))
+        w = max(0, min(w, self.mx - x, otra.mx - px))
+        for i in range(h):
+            self.chars[y+i][x:x+w] = otra.chars[py+i][px:px+w]
+            self.attrs[y+i][x:x+w] = otra.attrs[py+i][px:px+w]
+    
+    def copia(self) -> 'Pantalla':
+        c = Pantalla.__new__(Pantalla)
+        c.my, c.mx = self.my, self.mx
+        c.chars = [f[:] for f in self.chars]
+        c.attrs = [f[:] for f in self.attrs]
+        return c
+
+class VirtualUI(UI):
+    """Misma interfaz que UI pero dibuja en una Pantalla y lee teclas de una cola."""
+    def __init__(self, my: int = 24, mx: int = 80, teclas=()):
+        self.scr = None
+        self.my, self.mx = my, mx
+        self.tema = Tema.virtual()
+        self.colors = True
+        self.pantalla = Pantalla(my, mx)
+        self.teclas: deque = deque()
+        self.frames = 0
+        self.pulsar(*teclas)
+        self._init_estado()
+    
+    def pulsar(self, *teclas):
+        for k in teclas:
+            if isinstance(k, str): self.teclas.extend(ord(c) for c in k)
+            else: self.teclas.append(k)
+    
+    def resize(self, my: Optional[int] = None, mx: Optional[int] = None):
+        if my and mx:
+            self.my, self.mx = my, mx
+            self.pantalla.redimensionar(my, mx)
+    
+    def _addstr(self, y, x, s, attr=0) -> bool:
+        if 0 <= y < self.my and 0 <= x < self.mx:
+            self.pantalla.escribir(y, x, s[:self.mx-x-1], attr)
+            return True
+        return False
+    
+    def _limpiar(self): self.pantalla.limpiar()
+    def _refrescar(self): self.frames += 1
+    
+    def _leer(self):
+        if not self.teclas: raise EntradaAgotada()
+        return self.teclas.popleft()
+    
+    def _leer_timeout(self, ms: int):
+        if self.teclas: return self.teclas.popleft()
+        # Sin reloj real: la espera pasa al instante y los mensajes caducan antes
+        for t in self.toasts:
+            if t[3] is not None: t[3] -= ms / 1000
+        return -1
+    
+    # Las teclas en cola son un guion, no el jugador tomando el control: no cortan macros
+    def _tecla_disponible(self) -> bool: return False
+    def pausa(self, seg: float, consumir: bool = True): pass
+    
+    def _mostrar_toast(self, y, texto, attr): self._sombrear_toast(y, texto, attr)
+    def _quitar_toast(self, y): self._restaurar_toast(y)
+    
+    def texto(self) -> str: return self.pantalla.texto()
+    
+    def pad(self, alto: int, ancho: int): return Pantalla(alto + 1, ancho + 1)
+    
+    def pad_addstr(self, pad, y, x, s, attr=0):
+        if 0 <= y < pad.my and 0 <= x < pad.mx:
+            pad.escribir(y, x, s[:pad.mx-x], attr)
+    
+    def ver_pad(self, pad, py, px, y, x, h, w):
+        self.pantalla.pegar(pad, py, px, y, x, h, w)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# RENDER ANSI POR DIFERENCIAS (telnet, sockets, pipes)
+# ═══════════════════════════════════════════════════════════════════════════════
+ANSI_PARES = {1: 32, 2: 36, 3: 35, 4: 33, 5: 31, 6: 34}
+ANSI_HUECO = 4   # huecos menores se reescriben en vez de mover el cursor
+
+def sgr(attr: int) -> str:
+    cods = ["0"]
+    if attr & curses.A_BOLD: cods.append("1")
+    if attr & curses.A_DIM: cods.append("2")
+    if attr & curses.A_UNDERLINE: cods.append("4")
+    if attr & curses.A_REVERSE: cods.append("7")
+    par = (attr & curses.A_COLOR) >> 8
+    if par in ANSI_PARES: cods.append(str(ANSI_PARES[par]))
+    return "\x1b[" + ";".join(cods) + "m"
+
+class RenderANSI:
+    """Compara cada frame con el anterior y emite solo los tramos cambiados."""
+    def __init__(self):
+        self.prev: Optional[Pantalla] = None
+    
+    def invalidar(self): self.prev = None
+    
+    def volcar(self, pan: Pantalla) -> bytes:
+        out = []
+        if self.prev is None or (self.prev.my, self.prev.mx) != (pan.my, pan.mx):
+            out.append("\x1b[0m\x1b[2J")
+            prev = Pantalla(pan.my, pan.mx)
+        else:
+            prev = self.prev
+        cy = cx = -1
+        cur_attr = -1
+        for y in range(pan.my):
+            ch, at = pan.chars[y], pan.attrs[y]
+            pch, pat = prev.chars[y], prev.attrs[y]
+            if ch == pch and at == pat: continue
+            x, mx = 0, pan.mx
+            while x < mx:
+                if ch[x] == pch[x] and at[x] == pat[x]:
+                    x += 1; continue
+                # Tramo cambiado [x, fin), fusionando huecos pequeños
+                fin, hueco = x + 1, 0
+                while fin + hueco < mx and hueco <= ANSI_HUECO:
+                    if ch[fin+hueco] != pch[fin+hueco] or at[fin+hueco] != pat[fin+hueco]:
+                        fin += hueco + 1; hueco = 0
+                    else:
+                        hueco += 1
+                if (cy, cx) != (y, x):
+                    out.append(f"\x1b[{y+1};{x+1}H")
+                i = x
+                while i < fin:
+                    a = at[i]; j = i
+                    while j < fin and at[j] == a: j += 1
+                    if a != cur_attr:
+                        out.append(sgr(a)); cur_attr = a
+                    out.append("".join(ch[i:j]))
+                    i = j
+                cy, cx = y, fin
+                x = fin
+        self.prev = pan.copia()
+        return "".join(out).encode("utf-8")
+
+class AnsiUI(VirtualUI):
+    """VirtualUI que en cada refresh envía el delta ANSI a un flujo de bytes."""
+    def __init__(self, salida, my: int = 24, mx: int = 80, teclas=()):
+        super().__init__(my, mx, teclas)
+        self.salida = salida
+        self.render = RenderANSI()
+        self.bytes_enviados = 0
+    
+    def resize(self, my: Optional[int] = None, mx: Optional[int] = None):
+        super().resize(my, mx)
+        self.render.invalidar()
+    
+    def _refrescar(self):
+        super()._refrescar()
+        datos = self.render.volcar(self.pantalla)
+        if datos:
+            self.bytes_enviados += len(datos)
+            self.extra = f"| out {len(datos)} B"
+            self.salida.write(datos)
+            if hasattr(self.salida, "flush"): self.salida.flush()
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# CAPTURAS Y GRABACIONES
+# ═══════════════════════════════════════════════════════════════════════════════
+HTML_PARES = {1: "#5faf5f", 2: "#5fafaf", 3: "#af87d7", 4: "#d7af00", 5: "#d70000", 6: "#5f87d7"}
+
+def _tramos(chars: List[str], attrs: List[int], x0: int = 0, x1: Optional[int] = None):
+    """Recorre una fila en tramos de atributo constante: (x, texto, attr)."""
+    x, fin = x0, len(chars) if x1 is None else x1
+    while x < fin:
+        a = attrs[x]; j = x
+        while j < fin and attrs[j] == a: j += 1
+        yield x, "".join(chars[x:j]), a
+        x = j
+
+def exportar_html(pan: Pantalla) -> str:
+    import html
+    filas = []
+    for y in range(pan.my):
+        partes = []
+        for _, txt, a in _tramos(pan.chars[y], pan.attrs[y]):
+            estilo = []
+            par = (a & curses.A_COLOR) >> 8
+            if par in HTML_PARES: estilo.append(f"color:{HTML_PARES[par]}")
+            if a & curses.A_BOLD: estilo.append("font-weight:bold")
+            if a & curses.A_DIM: estilo.append("opacity:.6")
+            if a & (curses.A_REVERSE | curses.A_STANDOUT): estilo.append("background:#ccc;color:#000")
+            txt = html.escape(txt)
+            partes.append(f'<span style="{";".join(estilo)}">{txt}</span>' if estilo else txt)
+        filas.append("".join(partes).rstrip())
+    return ('<!DOCTYPE html><meta charset="utf-8"><title>KADATH</title>\n'
+            '<pre style="background:#111;color:#ccc;padding:1em;line-height:1.2">'
+            + "\n".join(filas) + "</pre>\n")
+
+def exportar_pantalla(pan: Pantalla, base: Path):
+    base.with_suffix(".txt").write_text(pan.texto() + "\n", encoding="utf-8")
+    base.with_suffix(".ansi").write_bytes(RenderANSI().volcar(pan) + b"\x1b[0m\n")
+    base.with_suffix(".html").write_text(exportar_html(pan), encoding="utf-8")
+
+class Grabador:
+    """Graba solo las diferencias entre frames, con marca de tiempo en ms.
+    Una línea JSON por frame: [ms, [[y, x, texto, attr], ...]] o [ms, "R", filas, cols]
+    al redimensionar. Se escribe a disco por lotes para acotar la memoria."""
+    LOTE = 64
+    
+    def __init__(self, ruta):
+        self.ruta = Path(ruta)
+        self.f = open(self.ruta, "w", encoding="utf-8")
+        self.f.write(json.dumps({"kadath_rec": 1, "version": VERSION,
+                                 "ts": datetime.now().isoformat()}) + "\n")
+        self.prev: Optional[Pantalla] = None
+        self.lote: List[str] = []
+        self.t0 = time.perf_counter()
+    
+    def frame(self, pan: Pantalla):
+        ms = int((time.perf_counter() - self.t0) * 1000)
+        if self.prev is None or (self.prev.my, self.prev.mx) != (pan.my, pan.mx):
+            self.prev = Pantalla(pan.my, pan.mx)
+            self.lote.append(json.dumps([ms, "R", pan.my, pan.mx]))
+        cambios = []
+        for y in range(pan.my):
+            ch, at = pan.chars[y], pan.attrs[y]
+            pch, pat = self.prev.chars[y], self.prev.attrs[y]
+            if ch == pch and at == pat: continue
+            x0 = 0
+            while ch[x0] == pch[x0] and at[x0] == pat[x0]: x0 += 1
+            x1 = pan.mx
+            while ch[x1-1] == pch[x1-1] and at[x1-1] == pat[x1-1]: x1 -= 1
+            cambios += [[y, x, txt, a] for x, txt, a in _tramos(ch, at, x0, x1)]
+            self.prev.chars[y], self.prev.attrs[y] = ch[:], at[:]
+        if cambios:
+            self.lote.append(json.dumps([ms, cambios], ensure_ascii=False, separators=(",", ":")))
+        if len(self.lote) >= self.LOTE: self.volcar()
+    
+    def volcar(self):
+        if self.lote:
+            self.f.write("\n".join(self.lote) + "\n")
+            self.f.flush()
+            self.lote.clear()
+    
+    def cerrar(self):
+        self.volcar()
+        self.f.close()
+
+def leer_grabacion(ruta):
+    """Reproduce una grabación: genera (ms, Pantalla) reutilizando el mismo buffer."""
+    pan = Pantalla()
+    with open(ruta, encoding="utf-8") as f:
+        f.readline()
+        for linea in f:
+            try: reg = json.loads(linea)
+            except ValueError: break   # última línea a medias
+            if len(reg) == 4 and reg[1] == "R":
+                pan = Pantalla(reg[2], reg[3]); continue
+            for y, x, txt, a in reg[1]:
+                pan.escribir(y, x, txt, a)
+            yield reg[0], pan
+
+class GrabadorTeclas:
+    """Graba cada tecla que entrega UI.getch junto con la semilla de la sesión y las partidas
+    existentes al empezar; con eso basta para reproducir la sesión sin terminal.
+    Cabecera JSON, luego líneas de códigos separados por espacios y al cerrar {"fin": huella}."""
+    LOTE = 64
+    
+    def __init__(self, ruta, semilla: int, my: int, mx: int, partidas: Dict[str, dict]):
+        self.f = open(ruta, "w", encoding="utf-8")
+        self.f.write(json.dumps({"kadath_teclas": 1, "version": VERSION, "semilla": semilla,
+                                 "filas": my, "cols": mx, "ts": datetime.now().isoformat(),
+                                 "partidas": partidas}, separators=(",", ":")) + "\n")
+        self.f.flush()
+        self.lote: List[int] = []
+    
+    def tecla(self, k: int):
+        self.lote.append(k)
+        if len(self.lote) >= self.LOTE: self.volcar()
+    
+    def volcar(self):
+        if self.lote:
+            self.f.write(" ".join(map(str, self.lote)) + "\n")
+            self.f.flush()
+            self.lote.clear()
+    
+    def cerrar(self, huella: Optional[str]):
+        self.volcar()
+        self.f.write(json.dumps({"fin": huella}) + "\n")
+        self.f.close()
+    
+    @staticmethod
+    def huella(p: Optional['Player']) -> Optional[str]:
+        if p is None: return None
+        return hashlib.sha1(json.dumps(p.to_dict(), sort_keys=True).encode()).hexdigest()[:16]
+
+def leer_teclas(ruta) -> Tuple[dict, List[int], Optional[str]]:
+    teclas, fin = [], None
+    with open(ruta, encoding="utf-8") as f:
+        cab = json.loads(f.readline())
+        for linea in f:
+            if linea.startswith("{"):
+                fin = json.loads(linea).get("fin"); break
+            try: teclas.extend(map(int, linea.split()))
+            except ValueError: break   # sesión cortada a media línea
+    return cab, teclas, fin
+
+def ver_grabacion(ruta, rapido: bool = False):
+    render, t_prev = RenderANSI(), 0
+    for ms, pan in leer_grabacion(ruta):
+        if not rapido: time.sleep(max(0, ms - t_prev) / 1000)
+        t_prev = ms
+        sys.stdout.buffer.write(render.volcar(pan))
+        sys.stdout.buffer.flush()
+    sys.stdout.buffer.write(b"\x1b[0m\n")
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # COMBAT ENGINE
@@ -465,8 +1393,7 @@ class Combat:
         self.activo = False
     
     def iniciar(self, enemigo: Enemy) -> str:
-        import copy
-        self.e = copy.deepcopy(enemigo)
+        self.e = enemigo.nuevo()
         self.turno = 0
         self.activo = True
         self.log = [f"¡{self.e.nombre} te ataca!"]
@@ -494,7 +1421,7 @@ class Combat:
             if self.p.vida <= 0: return "muerte"
             if self.p.cordura <= 0: return "locura"
             
-            time.sleep(0.3)
+            self.ui.pausa(0.3, consumir=False)
         
         return "huida"
     
@@ -524,8 +1451,9 @@ class Combat:
         
         # Log
         y = 14
-        for line in self.log[-4:]:
-            self.ui.addstr(y, 2, line[:70])
+        lineas = [l for msg in self.log[-4:] for l in envolver(msg, self.ui.mx - 4)]
+        for line in lineas[-4:]:
+            self.ui.addstr(y, 2, line)
             y += 1
         
         # Menu
@@ -538,8 +1466,12 @@ class Combat:
     
     def _turno_jugador(self) -> Optional[str]:
         k = self.ui.getch()
+        while k == curses.KEY_RESIZE:   # redimensionar no gasta el turno: solo se redibuja
+            self._dibujar()
+            k = self.ui.getch()
+        a = self.ui.entrada.accion("combate", k)
         
-        if k == ord('1'):
+        if a == "atacar":
             dano = random.randint(self.p.arma.dmin, self.p.arma.dmax)
             dano += self.p.nivel * 2
             dano = max(1, dano - self.e.defensa)
@@ -551,8 +1483,8 @@ class Combat:
                 if self.p.arma.dur <= 2:
                     self.log.append(f"¡{self.p.arma.nombre} casi se rompe!")
         
-        elif k == ord('2'):
-            cons = [i for i in self.p.inventario if i.usable]
+        elif a == "objeto":
+            cons = self.p.inventario.consumibles
             if cons:
                 c = cons[0]
                 for stat, val in c.efecto.items():
@@ -562,11 +1494,11 @@ class Combat:
             else:
                 self.log.append("No tienes consumibles")
         
-        elif k == ord('3'):
+        elif a == "esquivar":
             self.p.estados["esquivando"] = 1
             self.log.append("Te preparas para esquivar")
         
-        elif k == ord('4'):
+        elif a == "huir":
             prob = min(90, 40 + max(0, self.p.cordura - 50))
             if random.randint(1, 100) <= prob:
                 self.log.append("¡Escapas!")
@@ -575,7 +1507,7 @@ class Combat:
             else:
                 self.log.append("¡No puedes escapar!")
         
-        elif k == ord('5') and "conjuro_menor" in self.p.habilidades:
+        elif a == "conjuro" and "conjuro_menor" in self.p.habilidades:
             if self.p.voluntad >= 20:
                 self.p.mod_stat("voluntad", -20)
                 dano = random.randint(30, 50)
@@ -613,20 +1545,15 @@ class Combat:
         self.p.xp += xp
         self.p.mod_stat("oro", oro)
         self.p.bestiario[self.e.id] = self.p.bestiario.get(self.e.id, 0) + 1
-        
-        if "logro_01" not in self.p.logros:
-            self.p.logros.append("logro_01")
+        self.p.emitir(EnemigoDerrotado(self.e, xp, oro))
         
         self.p.flags["PACIFISTA"] = False
         
         # Loot
-        import copy
         for iid, prob in self.e.loot:
             if random.random() < prob:
-                if iid in CONSUMIBLES:
-                    self.p.add_item(copy.deepcopy(CONSUMIBLES[iid]))
-                elif iid in MISION_ITEMS:
-                    self.p.add_item(copy.deepcopy(MISION_ITEMS[iid]))
+                if iid in CONSUMIBLES or iid in MISION_ITEMS:
+                    self.p.add_item(DEF_ITEMS[iid].ejemplar())
         
         self.ui.clear()
         self.ui.caja(5, 10, 8, 45, "¡VICTORIA!")
@@ -641,80 +1568,1017 @@ class Combat:
 # ═══════════════════════════════════════════════════════════════════════════════
 # SAVE MANAGER
 # ═══════════════════════════════════════════════════════════════════════════════
-class SaveMgr:
+def escribir_atomico(ruta: Path, datos: bytes):
+    """Temporal + fsync + rename: el fichero final está completo o no ha cambiado."""
+    tmp = ruta.with_name(ruta.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(datos)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, ruta)
+    try:
+        fd = os.open(ruta.parent, os.O_RDONLY)
+        try: os.fsync(fd)
+        finally: os.close(fd)
+    except OSError: pass
+
+class EscritorPartidas:
+    """Un hilo por proceso escribe las partidas ya serializadas. Si llegan varias para la
+    misma ruta antes de escribirse, solo se escribe la última."""
     def __init__(self):
-        SAVE_DIR.mkdir(parents=True, exist_ok=True)
+        self.cond = threading.Condition()
+        self.pendientes: Dict[Path, bytes] = {}
+        self.en_curso: Optional[Tuple[Path, bytes]] = None
+        self.errores: Dict[Path, str] = {}
+        self.hechos: Dict[Path, Callable[[], None]] = {}   # se llaman tras escribir la ruta
+        self.escritas = self.fusionadas = 0
+        threading.Thread(target=self._bucle, name="kadath-saves", daemon=True).start()
+    
+    def encolar(self, ruta: Path, datos: bytes, hecho: Optional[Callable[[], None]] = None):
+        with self.cond:
+            # Se reinserta al final: lo encolado después se escribe después
+            if self.pendientes.pop(ruta, None) is not None: self.fusionadas += 1
+            self.pendientes[ruta] = datos
+            if hecho: self.hechos[ruta] = hecho
+            else: self.hechos.pop(ruta, None)
+            self.cond.notify_all()
     
-    def guardar(self, p: Player, slot: str = "auto") -> bool:
+    def pendiente(self, ruta: Path) -> Optional[bytes]:
+        """Lo último encolado para la ruta aunque aún no esté en disco."""
+        with self.cond:
+            if ruta in self.pendientes: return self.pendientes[ruta]
+            if self.en_curso and self.en_curso[0] == ruta: return self.en_curso[1]
+        return None
+    
+    def esperar(self, ruta: Optional[Path] = None, timeout: float = 10) -> bool:
+        def listo():
+            if ruta is None: return not self.pendientes and self.en_curso is None
+            return ruta not in self.pendientes and not (self.en_curso and self.en_curso[0] == ruta)
+        with self.cond:
+            return self.cond.wait_for(listo, timeout) and (ruta is None or ruta not in self.errores)
+    
+    def _bucle(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.pendientes)
+                ruta = next(iter(self.pendientes))
+                self.en_curso = (ruta, self.pendientes.pop(ruta))
+                hecho = self.hechos.pop(ruta, None)
+            try:
+                escribir_atomico(*self.en_curso)
+                self.errores.pop(ruta, None)
+                self.escritas += 1
+                if hecho: hecho()
+            except OSError as e:
+                self.errores[ruta] = str(e)
+            with self.cond:
+                self.en_curso = None
+                self.cond.notify_all()
+
+_escritor: Optional[EscritorPartidas] = None
+_escritor_lock = threading.Lock()
+
+def escritor() -> EscritorPartidas:
+    global _escritor
+    with _escritor_lock:
+        if _escritor is None: _escritor = EscritorPartidas()
+    return _escritor
+
+# Formato binario .ksv: "KSAV" + u16 versión de formato + u32 CRC32 del resto, luego la
+# tabla de cadenas propias del fichero y el valor codificado con etiquetas y varints.
+# Las cadenas de ESQUEMA_BIN[versión] no se escriben: el índice basta. Solo se añaden
+# versiones nuevas; una versión publicada no se modifica.
+MAGIA_BIN, FORMATO_BIN = b"KSAV", 2
+ESQUEMA_BIN = {1: (
+    "version", "ts", "player",
+    "vida", "vida_max", "cordura", "cordura_max", "voluntad", "voluntad_max", "vel_base",
+    "reputacion", "oro", "nivel", "xp", "bonus_dano", "bonus_resist", "arma", "armadura",
+    "inventario", "habilidades", "flags", "mapa_frags", "muertes", "quests_activas",
+    "quests_completas", "logros", "bestiario", "zona", "zonas_visitadas", "descansos",
+    "ciclo", "turno", "tiempo", "eventos", "decisiones",
+    "GATOS_ALIADOS", "GATOS_HOSTILES", "RUTA_SEGURA", "PACIFISTA", "tutorial", "DIA", "NOCHE",
+)}
+ESQUEMA_BIN[2] = ESQUEMA_BIN[1] + ("seq", "s", "+", "-")   # instantáneas y diario
+T_NONE, T_FALSO, T_CIERTO, T_INT, T_FLOAT, T_STR, T_LISTA, T_DICT, T_FLOAT_ENTERO = range(9)
+
+def _varint(buf: bytearray, n: int):
+    while n >= 0x80:
+        buf.append(n & 0x7F | 0x80)
+        n >>= 7
+    buf.append(n)
+
+def _leer_varint(b: bytes, i: int) -> Tuple[int, int]:
+    n = desp = 0
+    while True:
+        c = b[i]; i += 1
+        n |= (c & 0x7F) << desp
+        if c < 0x80: return n, i
+        desp += 7
+
+def a_binario(data) -> bytes:
+    base = ESQUEMA_BIN[FORMATO_BIN]
+    tabla = {c: i for i, c in enumerate(base)}
+    propias: List[str] = []
+    cuerpo = bytearray()
+    def cad(c: str):
+        i = tabla.get(c)
+        if i is None:
+            i = tabla[c] = len(tabla)
+            propias.append(c)
+        _varint(cuerpo, i)
+    def val(v):
+        if v is None: cuerpo.append(T_NONE)
+        elif v is True: cuerpo.append(T_CIERTO)
+        elif v is False: cuerpo.append(T_FALSO)
+        elif isinstance(v, int):
+            cuerpo.append(T_INT); _varint(cuerpo, v * 2 if v >= 0 else -v * 2 - 1)
+        elif isinstance(v, float):
+            if v.is_integer() and abs(v) < 2**53:
+                n = int(v); cuerpo.append(T_FLOAT_ENTERO); _varint(cuerpo, n * 2 if n >= 0 else -n * 2 - 1)
+            else:
+                cuerpo.append(T_FLOAT); cuerpo.extend(struct.pack("<d", v))
+        elif isinstance(v, str): cuerpo.append(T_STR); cad(v)
+        elif isinstance(v, (list, tuple)):
+            cuerpo.append(T_LISTA); _varint(cuerpo, len(v))
+            for x in v: val(x)
+        elif isinstance(v, dict):
+            cuerpo.append(T_DICT); _varint(cuerpo, len(v))
+            for k, x in v.items(): cad(k); val(x)
+        else: raise TypeError(f"no serializable: {type(v).__name__}")
+    val(data)
+    resto = bytearray()
+    _varint(resto, len(propias))
+    for c in propias:
+        e = c.encode("utf-8")
+        _varint(resto, len(e)); resto += e
+    resto += cuerpo
+    return struct.pack("<4sHI", MAGIA_BIN, FORMATO_BIN, zlib.crc32(resto)) + bytes(resto)
+
+def de_binario(b: bytes):
+    magia, ver, crc = struct.unpack_from("<4sHI", b)
+    if magia != MAGIA_BIN or ver not in ESQUEMA_BIN: raise ValueError(f"formato de partida desconocido ({ver})")
+    if zlib.crc32(memoryview(b)[10:]) != crc: raise ValueError("CRC incorrecto: partida dañada")
+    n, i = _leer_varint(b, 10)
+    tabla = list(ESQUEMA_BIN[ver])
+    for _ in range(n):
+        ln, i = _leer_varint(b, i)
+        tabla.append(b[i:i+ln].decode("utf-8")); i += ln
+    def val(i):
+        t = b[i]; i += 1
+        if t == T_NONE: return None, i
+        if t == T_CIERTO: return True, i
+        if t == T_FALSO: return False, i
+        if t in (T_INT, T_FLOAT_ENTERO):
+            z, i = _leer_varint(b, i)
+            n = z >> 1 if not z & 1 else -(z >> 1) - 1
+            return (n if t == T_INT else float(n)), i
+        if t == T_FLOAT: return struct.unpack_from("<d", b, i)[0], i + 8
+        if t == T_STR:
+            k, i = _leer_varint(b, i); return tabla[k], i
+        if t == T_LISTA:
+            n, i = _leer_varint(b, i); out = []
+            for _ in range(n):
+                x, i = val(i); out.append(x)
+            return out, i
+        if t == T_DICT:
+            n, i = _leer_varint(b, i); out = {}
+            for _ in range(n):
+                k, i = _leer_varint(b, i); x, i = val(i); out[tabla[k]] = x
+            return out, i
+        raise ValueError(f"etiqueta desconocida {t}")
+    return val(i)[0]
+
+# Compresión opcional (KADATH_COMPRIMIR=zlib|lzma) con compresores incrementales: el
+# JSON se comprime a trozos según se genera y al leer se descomprime según llega del disco
+# (lzma con preset 1: diccionario de 1 MiB; el preset por defecto reserva ~100 MB)
+COMPRESORES = {"zlib": (lambda: zlib.compressobj(9), zlib.decompressobj),
+               "lzma": (lambda: lzma.LZMACompressor(preset=1), lzma.LZMADecompressor)}
+MAGIA_XZ = b"\xfd7zXZ\x00"
+TROZO = 1 << 16
+
+def compresion_de(cab: bytes) -> Optional[str]:
+    if cab[:6] == MAGIA_XZ: return "lzma"
+    if len(cab) >= 2 and cab[0] == 0x78 and (cab[0] << 8 | cab[1]) % 31 == 0: return "zlib"
+    return None
+
+def comprimir_trozos(trozos, compresion: str) -> bytes:
+    """Solo la codificación JSON llega en trozos (iterencode); el binario .ksv se construye
+    entero con a_binario y se comprime de una vez."""
+    c = COMPRESORES[compresion][0]()
+    out, buf, n = bytearray(), [], 0
+    for t in trozos:       # iterencode da trozos diminutos: se agrupan antes de comprimir
+        buf.append(t); n += len(t)
+        if n >= TROZO:
+            out += c.compress(b"".join(buf)); buf, n = [], 0
+    out += c.compress(b"".join(buf))
+    out += c.flush()
+    return bytes(out)
+
+def descomprimir_trozos(trozos) -> bytearray:
+    """Concatena trozos de disco o memoria descomprimiendo si la cabecera lo indica.
+    El resultado es la partida entera: json.loads y de_binario no decodifican por partes,
+    así que al cargar la partida descomprimida está completa en memoria. Solo se ahorra
+    tener además el fichero comprimido entero y una segunda copia en bytes."""
+    out, d = bytearray(), None
+    for t in trozos:
+        if d is None:
+            alg = compresion_de(t)
+            if alg is None:
+                out += t; d = False; continue
+            d = COMPRESORES[alg][1]()
+        out += d.decompress(t) if d else t
+    return out
+
+def leer_trozos(ruta: Path):
+    with open(ruta, "rb") as f:
+        while True:
+            t = f.read(TROZO)
+            if not t: return
+            yield t
+
+def decodificar_partida(datos: bytes) -> dict:
+    """Detecta compresión y formato por la cabecera: binario .ksv o JSON."""
+    if compresion_de(datos): datos = descomprimir_trozos([datos])
+    if datos[:4] == MAGIA_BIN: return de_binario(datos)
+    return json.loads(datos)
+
+def leer_partida(ruta: Path) -> dict:
+    return decodificar_partida(descomprimir_trozos(leer_trozos(ruta)))
+
+# Migración de partidas. La versión sola no identifica el esquema: las v0.3 de DeepSeek y
+# de Qwen guardan ambas "4.0" con campos distintos, y la v1.0 de DeepSeek guarda "1.0".
+# Cada paso lleva un esquema al siguiente hasta llegar a VERSION; lo que este juego no
+# usa se conserva en player["extra"] en vez de perderse al cargar.
+CAMPOS_VARIANTE = {
+    "deepseek": ("aliados", "fase_lunar", "sellos_lunares", "conocimiento", "bonus_resist_cordura"),
+    "qwen": ("conjuros_aprendidos", "trastornos", "capa_sueño", "ng_plus", "partidas_completadas",
+             "rituales_completados", "enemigos_derrotados", "turnos_totales"),
+}
+
+def esquema_partida(data: dict) -> str:
+    v, pl = str(data.get("version", "1.0")), data.get("player", {})
+    for var, campos in CAMPOS_VARIANTE.items():
+        if any(c in pl for c in campos): return f"{v}-{var}"
+    return v
+
+def _a_extra(variante: str):
+    def paso(data: dict) -> dict:
+        pl = data["player"]
+        extra = pl.setdefault("extra", {})
+        for c in CAMPOS_VARIANTE[variante]:
+            if c in pl: extra[c] = pl.pop(c)
+        extra["variante"] = variante
+        return data
+    return paso
+
+def _sin_cambios(data: dict) -> dict: return data
+
+MIGRACIONES: Dict[str, Tuple[str, Callable[[dict], dict]]] = {
+    "1.0": ("3.0", _sin_cambios),                     # partidas sin versión
+    "3.1": ("3.0", _sin_cambios),                     # v0.2 de DeepSeek y Qwen: mismo esquema
+    "1.0-deepseek": ("4.0-deepseek", _sin_cambios),   # la v1.0 de DeepSeek guarda el de su v0.3
+    "4.0-deepseek": ("3.0", _a_extra("deepseek")),
+    "4.0-qwen": ("3.0", _a_extra("qwen")),
+}
+
+def _sanear_ids(pl: dict) -> List[str]:
+    """Ids que este juego no conoce pasan a extra; devuelve avisos para el informe."""
+    avisos, extra = [], pl.setdefault("extra", {})
+    objetos = {**CONSUMIBLES, **MISION_ITEMS, **ARMAS, **ARMADURAS}
+    for clave, validos in [("inventario", objetos), ("zonas_visitadas", ZONAS),
+                           ("quests_activas", QUESTS), ("quests_completas", QUESTS)]:
+        fuera = [x for x in pl.get(clave, []) if x not in validos]
+        if fuera:
+            pl[clave] = [x for x in pl[clave] if x in validos]
+            extra[clave] = fuera
+            avisos.append(f"{clave}: {', '.join(map(str, fuera))}")
+    for clave, validos, defecto in [("arma", ARMAS, "punos"), ("armadura", ARMADURAS, "sin_armadura"),
+                                    ("zona", ZONAS, "zona_1")]:
+        if pl.get(clave, defecto) not in validos:
+            extra[clave] = pl[clave]
+            pl[clave] = defecto
+            avisos.append(f"{clave}: {extra[clave]} -> {defecto}")
+    if not extra: pl.pop("extra")
+    return avisos
+
+def migrar_partida(data: dict) -> Tuple[dict, List[str], List[str]]:
+    """(partida en el esquema de VERSION, pasos aplicados, avisos)."""
+    if not isinstance(data, dict) or not isinstance(data.get("player"), dict):
+        raise ValueError("no es una partida: falta 'player'")
+    pasos = []
+    esquema = esquema_partida(data)
+    while esquema != VERSION:
+        if esquema not in MIGRACIONES or len(pasos) > len(MIGRACIONES):
+            raise ValueError(f"esquema de partida desconocido: {esquema}")
+        destino, fn = MIGRACIONES[esquema]
+        data = fn(data)
+        data["version"] = destino.split("-")[0]
+        pasos.append(f"{esquema} -> {destino}")
+        esquema = esquema_partida(data)
+    return data, pasos, (_sanear_ids(data["player"]) if pasos else [])
+
+class Diario:
+    """Registro de solo-añadir con los cambios de una partida desde su última instantánea.
+    Cada registro es [u32 largo][.ksv con {"seq", "s": claves nuevas, "+": añadidos a
+    listas, "-": claves borradas}]. El CRC de cada uno delata una cola a medio escribir."""
+    LOTE = 8    # registros entre fsync
+    
+    def __init__(self, ruta: Path):
+        self.ruta = ruta
+        self.lock = threading.Lock()
+        self.f = None
+        self.sin_fsync = 0
+        regs, fin, tam = self._escanear()
+        self.n = len(regs)
+        if fin < tam:
+            # Cola a medio escribir tras una caída: se corta para que lo nuevo no quede detrás
+            with open(self.ruta, "r+b") as f:
+                f.truncate(fin); f.flush(); os.fsync(f.fileno())
+    
+    def anadir(self, reg: dict):
+        datos = a_binario(reg)
+        with self.lock:
+            if self.f is None: self.f = open(self.ruta, "ab")
+            self.f.write(struct.pack("<I", len(datos)) + datos)
+            self.f.flush()
+            self.n += 1
+            self.sin_fsync += 1
+            if self.sin_fsync >= self.LOTE: self._fsync()
+    
+    def _fsync(self):
+        if self.f and self.sin_fsync:
+            os.fsync(self.f.fileno())
+            self.sin_fsync = 0
+    
+    def _escanear(self) -> Tuple[List[dict], int, int]:
+        """(registros válidos, fin del último válido, tamaño del fichero)."""
+        try: b = self.ruta.read_bytes()
+        except OSError: return [], 0, 0
+        regs, i = [], 0
+        while i + 4 <= len(b):
+            (ln,) = struct.unpack_from("<I", b, i)
+            if i + 4 + ln > len(b): break
+            try: regs.append(de_binario(b[i+4:i+4+ln]))
+            except (ValueError, IndexError, struct.error): break
+            i += 4 + ln
+        return regs, i, len(b)
+    
+    def _leer(self) -> List[dict]: return self._escanear()[0]
+    
+    def leer(self) -> List[dict]:
+        with self.lock: return self._leer()
+    
+    def recortar(self, seq: int):
+        """Quita lo que ya recoge una instantánea escrita con ese seq."""
+        with self.lock:
+            resto = [r for r in self._leer() if r["seq"] > seq]
+            if self.f: self.f.close(); self.f = None
+            datos = b"".join(struct.pack("<I", len(d)) + d for d in map(a_binario, resto))
+            escribir_atomico(self.ruta, datos)
+            self.n, self.sin_fsync = len(resto), 0
+    
+    def cerrar(self):
+        with self.lock:
+            self._fsync()
+            if self.f: self.f.close(); self.f = None
+
+def _copia_estado(d: dict) -> dict:
+    """Copia con listas y dicts propios (los de to_dict son los del Player)."""
+    return {k: list(v) if isinstance(v, list) else dict(v) if isinstance(v, dict) else v
+            for k, v in d.items()}
+
+def diferencia_estado(antes: dict, ahora: dict) -> dict:
+    reg: Dict[str, Any] = {}
+    for k, v in ahora.items():
+        a = antes.get(k)
+        if k in antes and a == v: continue
+        if isinstance(v, list) and isinstance(a, list) and len(v) > len(a) and v[:len(a)] == a:
+            reg.setdefault("+", {})[k] = v[len(a):]
+        else:
+            reg.setdefault("s", {})[k] = v
+    borradas = [k for k in antes if k not in ahora]
+    if borradas: reg["-"] = borradas
+    return reg
+
+def aplicar_diferencia(d: dict, reg: dict):
+    d.update(reg.get("s", {}))
+    for k, extra in reg.get("+", {}).items(): d[k] = list(d.get(k, [])) + extra
+    for k in reg.get("-", []): d.pop(k, None)
+
+class SaveMgr:
+    SLOTS = ["auto", "slot_1", "slot_2", "slot_3"]
+    INDICE = "slots.idx"
+    EXT = {"bin": ".ksv", "json": ".json"}
+    DIARIO_MAX = 64   # registros antes de compactar en una instantánea
+    
+    def __init__(self, directorio: Optional[Path] = None, formato: Optional[str] = None,
+                 compresion: Optional[str] = None):
+        self.dir = directorio or SAVE_DIR
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.formato = formato or os.environ.get("KADATH_FORMATO", "bin")
+        if self.formato not in self.EXT: self.formato = "bin"
+        self.compresion = self._compresion(compresion)
+        self.ms_ultimo = 0.0
+        # Índice lateral slot -> zona, nivel, ts, crc, tam: los menús no abren las partidas
+        self._indice: Optional[Dict[str, dict]] = None
+        # Diario por slot: último estado conocido y número de secuencia
+        self._diarios: Dict[str, Diario] = {}
+        self._base: Dict[str, dict] = {}
+        self._seq: Dict[str, int] = {}
+    
+    def ruta(self, slot: str) -> Path: return self.dir / f"{slot}{self.EXT[self.formato]}"
+    
+    @staticmethod
+    def _compresion(c: Optional[str]) -> Optional[str]:
+        c = c or os.environ.get("KADATH_COMPRIMIR")
+        return c if c in COMPRESORES else None
+    
+    def codificar(self, data: dict) -> bytes:
+        if self.compresion:
+            if self.formato == "json":
+                trozos = (t.encode("utf-8") for t in json.JSONEncoder(separators=(",", ":")).iterencode(data))
+            else: trozos = [a_binario(data)]
+            return comprimir_trozos(trozos, self.compresion)
+        if self.formato == "json": return json.dumps(data, indent=2).encode("utf-8")
+        return a_binario(data)
+    
+    def _localizar(self, slot: str) -> Optional[Tuple[Path, Optional[bytes]]]:
+        """(ruta, bytes pendientes o None) de la partida. Si hay copia en los dos formatos
+        manda la pendiente de escribir y si no la más reciente."""
+        en_disco = []
+        for ext in self.EXT.values():
+            r = self.dir / f"{slot}{ext}"
+            datos = escritor().pendiente(r) if _escritor else None
+            if datos is not None: return r, datos
+            try: en_disco.append((r.stat().st_mtime_ns, r))
+            except OSError: pass
+        return (max(en_disco)[1], None) if en_disco else None
+    
+    def guardar(self, p: Player, slot: str = "auto", esperar: bool = False) -> bool:
+        """Serializa aquí (hilo de la UI) y deja la escritura al EscritorPartidas.
+        Con esperar=True vuelve cuando está en disco y devuelve si se escribió."""
+        t = time.perf_counter()
         try:
-            data = {"version": VERSION, "ts": datetime.now().isoformat(), "player": p.to_dict()}
-            with open(SAVE_DIR / f"{slot}.json", 'w') as f:
-                json.dump(data, f, indent=2)
+            if slot not in self._seq: self._cargar_base(slot)
+            estado = _copia_estado(p.to_dict())
+            seq = self._seq[slot]
+            data = {"version": VERSION, "ts": datetime.now().isoformat(), "seq": seq, "player": estado}
+            ruta, datos = self.ruta(slot), self.codificar(data)
+            d = self._diarios.get(slot) or (self._diario(slot) if self._ruta_diario(slot).exists() else None)
+            escritor().encolar(ruta, datos, (lambda: d.recortar(seq)) if d else None)
+            self._base[slot] = estado
+            self.indice()[slot] = self._meta(data, datos)
+            self._guardar_indice()
+            return escritor().esperar(ruta) if esperar else True
+        except: return False
+        finally: self.ms_ultimo = (time.perf_counter() - t) * 1000
+    
+    def _leer(self, slot: str) -> Optional[dict]:
+        """Instantánea más los registros del diario posteriores a ella."""
+        loc = self._localizar(slot)
+        if loc is None: return None
+        ruta, datos = loc
+        data = leer_partida(ruta) if datos is None else decodificar_partida(datos)
+        return self._con_diario(slot, migrar_partida(data)[0])
+    
+    def _con_diario(self, slot: str, data: dict) -> dict:
+        if slot in self._diarios or self._ruta_diario(slot).exists():
+            regs = self._diario(slot).leer()
+            if "seq" not in data:
+                # Instantánea escrita sin diario (otra versión del juego): el diario es anterior
+                if regs: self._diario(slot).recortar(max(r["seq"] for r in regs))
+                return data
+            for reg in regs:
+                if reg["seq"] > data["seq"]:
+                    aplicar_diferencia(data["player"], reg)
+                    data["seq"] = reg["seq"]
+        return data
+    
+    def _ruta_diario(self, slot: str) -> Path: return self.dir / f"{slot}.diario"
+    
+    def _diario(self, slot: str) -> Diario:
+        if slot not in self._diarios: self._diarios[slot] = Diario(self._ruta_diario(slot))
+        return self._diarios[slot]
+    
+    def _cargar_base(self, slot: str) -> bool:
+        try: data = self._leer(slot)
+        except: data = None
+        if data is None or "seq" not in data:   # sin seq el diario no se podría reaplicar
+            regs = self._diario(slot).leer() if self._ruta_diario(slot).exists() else []
+            self._seq[slot] = max((r["seq"] for r in regs), default=0)
+            return False
+        self._base[slot] = _copia_estado(data["player"])
+        self._seq[slot] = data.get("seq", 0)
+        return True
+    
+    def anotar(self, p: Player, slot: str = "auto") -> bool:
+        """Añade al diario solo lo que cambió desde la última anotación o instantánea.
+        Cada DIARIO_MAX registros se compacta con una instantánea completa."""
+        if slot not in self._base and not self._cargar_base(slot): return self.guardar(p, slot)
+        t = time.perf_counter()
+        try:
+            estado = _copia_estado(p.to_dict())
+            reg = diferencia_estado(self._base[slot], estado)
+            if not reg: return True
+            self._seq[slot] += 1
+            reg["seq"] = self._seq[slot]
+            d = self._diario(slot)
+            d.anadir(reg)
+            self._base[slot] = estado
+            e = self.indice().get(slot)
+            if e and not e.get("corrupto") and (e.get("zona"), e.get("nivel")) != (estado["zona"], estado["nivel"]):
+                e.update(zona=estado["zona"], nivel=estado["nivel"])
+                self._guardar_indice()
+            if d.n >= self.DIARIO_MAX: return self.guardar(p, slot)
             return True
         except: return False
+        finally: self.ms_ultimo = (time.perf_counter() - t) * 1000
     
     def cargar(self, slot: str = "auto") -> Optional[Player]:
-        try:
-            with open(SAVE_DIR / f"{slot}.json") as f:
-                data = json.load(f)
-            return Player.from_dict(data["player"])
+        try: return Player.from_dict(self._leer(slot)["player"])
         except: return None
     
+    def cerrar(self):
+        for d in self._diarios.values(): d.cerrar()
+        if _escritor: _escritor.esperar()
+    
+    def _nombres(self) -> List[str]:
+        nombres = {fp.stem for ext in self.EXT.values() for fp in self.dir.glob(f"*{ext}")}
+        if _escritor:
+            with _escritor.cond:
+                nombres |= {r.stem for r in _escritor.pendientes
+                            if r.parent == self.dir and r.suffix in self.EXT.values()}
+        return sorted(nombres)
+    
+    def exportar(self) -> Dict[str, dict]:
+        """Contenido de todas las partidas del directorio (para repeticiones y copias)."""
+        out = {}
+        for slot in self._nombres():
+            try: out[slot] = self._leer(slot)
+            except (OSError, ValueError, struct.error): pass
+        return out
+    
+    def importar(self, partidas: Dict[str, dict]):
+        for slot, data in partidas.items():
+            escribir_atomico(self.ruta(slot), self.codificar(data))
+    
+    def exportar_json(self, destino: Path) -> List[Path]:
+        """Copia legible de todas las partidas, sea cual sea su formato."""
+        destino.mkdir(parents=True, exist_ok=True)
+        hechas = []
+        for slot, data in self.exportar().items():
+            fp = destino / f"{slot}.json"
+            escribir_atomico(fp, json.dumps(data, indent=2, ensure_ascii=False).encode("utf-8"))
+            hechas.append(fp)
+        return hechas
+    
+    @staticmethod
+    def _meta(data: dict, datos: bytes) -> dict:
+        pl = data["player"]
+        return {"zona": pl.get("zona", "?"), "nivel": pl.get("nivel", 1), "ts": data.get("ts"),
+                "crc": zlib.crc32(datos), "tam": len(datos)}
+    
+    def indice(self) -> Dict[str, dict]:
+        if self._indice is None:
+            try: self._indice = json.loads((self.dir / self.INDICE).read_bytes())
+            except (OSError, ValueError): self._indice = {}
+        return self._indice
+    
+    def _guardar_indice(self):
+        escritor().encolar(self.dir / self.INDICE, json.dumps(self._indice).encode("utf-8"))
+    
+    def _entrada_indice(self, slot: str, t_indice: int) -> Tuple[Optional[dict], bool]:
+        """(entrada, cambiada). Solo se relee la partida si el índice no la describe:
+        falta, cambió de tamaño o se escribió después que el índice."""
+        idx, loc = self.indice(), self._localizar(slot)
+        e = idx.get(slot)
+        if loc is None: return None, idx.pop(slot, None) is not None
+        ruta, datos = loc
+        if datos is None:
+            try: st = ruta.stat()
+            except OSError:
+                return None, idx.pop(slot, None) is not None
+            if e and e.get("tam") == st.st_size and st.st_mtime_ns <= t_indice: return e, False
+            datos = ruta.read_bytes()
+        elif e and e.get("tam") == len(datos): return e, False
+        try: e = self._meta(self._con_diario(slot, decodificar_partida(datos)), datos)
+        except (ValueError, KeyError, TypeError, AttributeError, IndexError, struct.error): e = {"corrupto": True, "tam": len(datos)}
+        idx[slot] = e
+        return e, True
+    
+    def slots(self) -> List[dict]:
+        try: t_indice = (self.dir / self.INDICE).stat().st_mtime_ns
+        except OSError: t_indice = -1
+        result, cambiado = [], False
+        for s in self.SLOTS:
+            e, c = self._entrada_indice(s, t_indice)
+            cambiado |= c
+            if e is None: result.append({"nombre": s, "existe": False})
+            elif e.get("corrupto"): result.append({"nombre": s, "existe": True, "corrupto": True})
+            else: result.append({"nombre": s, "existe": True, "zona": e["zona"], "nivel": e["nivel"], "ts": e["ts"]})
+        if cambiado: self._guardar_indice()
+        return result
+
+# Almacén SQLite (KADATH_DB=<fichero>): perfiles, slots sin límite e historial de
+# instantáneas. Una conexión por proceso y fichero, en modo WAL, compartida entre hilos.
+ESQUEMA_SQL = """
+CREATE TABLE IF NOT EXISTS perfiles (
+    id INTEGER PRIMARY KEY, nombre TEXT UNIQUE NOT NULL, creado TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS instantaneas (
+    id INTEGER PRIMARY KEY, perfil INTEGER NOT NULL REFERENCES perfiles(id), slot TEXT NOT NULL,
+    ts TEXT NOT NULL, version TEXT, zona TEXT, nivel INTEGER, datos BLOB NOT NULL);
+CREATE INDEX IF NOT EXISTS ix_inst_perfil_ts ON instantaneas(perfil, ts);
+CREATE INDEX IF NOT EXISTS ix_inst_slot ON instantaneas(perfil, slot, id);
+CREATE TABLE IF NOT EXISTS slots (
+    perfil INTEGER NOT NULL REFERENCES perfiles(id), slot TEXT NOT NULL,
+    instantanea INTEGER NOT NULL REFERENCES instantaneas(id), PRIMARY KEY (perfil, slot));
+"""
+_conexiones: Dict[str, Tuple[sqlite3.Connection, threading.Lock]] = {}
+_conexiones_lock = threading.Lock()
+
+def conexion_db(ruta) -> Tuple[sqlite3.Connection, threading.Lock]:
+    clave = str(Path(ruta).resolve())
+    with _conexiones_lock:
+        if clave not in _conexiones:
+            con = sqlite3.connect(clave, check_same_thread=False, cached_statements=64)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            con.execute("PRAGMA foreign_keys=ON")
+            con.executescript(ESQUEMA_SQL)
+            _conexiones[clave] = (con, threading.Lock())
+    return _conexiones[clave]
+
+class SaveMgrSQLite(SaveMgr):
+    """Misma interfaz que SaveMgr sobre SQLite. guardar añade una instantánea al historial
+    (se conservan HISTORIAL por slot); anotar reescribe la actual sin crecer el historial.
+    Las sentencias son constantes con parámetros: sqlite3 las prepara una vez y las cachea."""
+    HISTORIAL = 5
+    
+    def __init__(self, ruta_db, perfil: str = "local", formato: Optional[str] = None,
+                 compresion: Optional[str] = None):
+        self.ruta_db = Path(ruta_db)
+        self.formato = formato if formato in self.EXT else "bin"
+        self.compresion = self._compresion(compresion)
+        self.ms_ultimo = 0.0
+        self.con, self.lock = conexion_db(self.ruta_db)
+        with self.lock, self.con:
+            self.con.execute("INSERT OR IGNORE INTO perfiles (nombre, creado) VALUES (?, ?)",
+                             (perfil, datetime.now().isoformat()))
+            (self.perfil,) = self.con.execute("SELECT id FROM perfiles WHERE nombre = ?", (perfil,)).fetchone()
+    
+    def _fila(self, slot: str, data: dict):
+        pl = data["player"]
+        return (data["ts"], data["version"], pl.get("zona"), pl.get("nivel"), self.codificar(data))
+    
+    def guardar(self, p: Player, slot: str = "auto", esperar: bool = False) -> bool:
+        t = time.perf_counter()
+        try:
+            data = {"version": VERSION, "ts": datetime.now().isoformat(), "player": p.to_dict()}
+            self._insertar(slot, data)
+            return True
+        except: return False
+        finally: self.ms_ultimo = (time.perf_counter() - t) * 1000
+    
+    def _insertar(self, slot: str, data: dict):
+        fila = self._fila(slot, data)
+        with self.lock, self.con:
+            cur = self.con.execute(
+                "INSERT INTO instantaneas (perfil, slot, ts, version, zona, nivel, datos) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self.perfil, slot) + fila)
+            self.con.execute("INSERT OR REPLACE INTO slots (perfil, slot, instantanea) VALUES (?, ?, ?)",
+                             (self.perfil, slot, cur.lastrowid))
+            self.con.execute(
+                "DELETE FROM instantaneas WHERE perfil = ? AND slot = ? AND id NOT IN "
+                "(SELECT id FROM instantaneas WHERE perfil = ? AND slot = ? ORDER BY id DESC LIMIT ?)",
+                (self.perfil, slot, self.perfil, slot, self.HISTORIAL))
+    
+    def anotar(self, p: Player, slot: str = "auto") -> bool:
+        t = time.perf_counter()
+        try:
+            data = {"version": VERSION, "ts": datetime.now().isoformat(), "player": p.to_dict()}
+            with self.lock, self.con:
+                n = self.con.execute(
+                    "UPDATE instantaneas SET ts = ?, version = ?, zona = ?, nivel = ?, datos = ? "
+                    "WHERE id = (SELECT instantanea FROM slots WHERE perfil = ? AND slot = ?)",
+                    self._fila(slot, data) + (self.perfil, slot)).rowcount
+            if not n: self._insertar(slot, data)
+            return True
+        except: return False
+        finally: self.ms_ultimo = (time.perf_counter() - t) * 1000
+    
+    def _leer(self, slot: str) -> Optional[dict]:
+        with self.lock:
+            fila = self.con.execute(
+                "SELECT i.datos FROM slots s JOIN instantaneas i ON i.id = s.instantanea "
+                "WHERE s.perfil = ? AND s.slot = ?", (self.perfil, slot)).fetchone()
+        return migrar_partida(decodificar_partida(fila[0]))[0] if fila else None
+    
+    def cerrar(self): pass   # la conexión es del proceso
+    
+    def _nombres(self) -> List[str]:
+        with self.lock:
+            return [r[0] for r in self.con.execute(
+                "SELECT slot FROM slots WHERE perfil = ? ORDER BY slot", (self.perfil,))]
+    
+    def importar(self, partidas: Dict[str, dict]):
+        for slot, data in partidas.items(): self._insertar(slot, data)
+    
     def slots(self) -> List[dict]:
+        with self.lock:
+            filas = {r[0]: r[1:] for r in self.con.execute(
+                "SELECT s.slot, i.zona, i.nivel, i.ts FROM slots s JOIN instantaneas i ON i.id = s.instantanea "
+                "WHERE s.perfil = ?", (self.perfil,))}
         result = []
-        for s in ["auto", "slot_1", "slot_2", "slot_3"]:
-            fp = SAVE_DIR / f"{s}.json"
-            if fp.exists():
-                try:
-                    with open(fp) as f:
-                        d = json.load(f)
-                    result.append({"nombre": s, "existe": True, 
-                                   "zona": d["player"].get("zona", "?"),
-                                   "nivel": d["player"].get("nivel", 1)})
-                except:
-                    result.append({"nombre": s, "existe": True, "corrupto": True})
-            else:
-                result.append({"nombre": s, "existe": False})
+        for s in self.SLOTS + sorted(set(filas) - set(self.SLOTS)):
+            if s in filas:
+                zona, nivel, ts = filas[s]
+                result.append({"nombre": s, "existe": True, "zona": zona, "nivel": nivel, "ts": ts})
+            else: result.append({"nombre": s, "existe": False})
         return result
+    
+    def ultimas(self) -> List[tuple]:
+        """Última partida de cada perfil: (perfil, slot, ts, zona, nivel)."""
+        with self.lock:
+            return self.con.execute(
+                "SELECT p.nombre, i.slot, i.ts, i.zona, i.nivel FROM perfiles p "
+                "JOIN instantaneas i ON i.id = (SELECT id FROM instantaneas WHERE perfil = p.id "
+                "ORDER BY ts DESC LIMIT 1) ORDER BY i.ts DESC").fetchall()
+
+def abrir_partidas(perfil: str = "local", directorio: Optional[Path] = None) -> SaveMgr:
+    """SaveMgrSQLite si KADATH_DB está definido; si no, ficheros en directorio/SAVE_DIR."""
+    db = os.environ.get("KADATH_DB")
+    if db: return SaveMgrSQLite(db, perfil, os.environ.get("KADATH_FORMATO"))
+    return SaveMgr(directorio)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# MAPA DEL MUNDO (generado desde el grafo de conexiones)
+# ═══════════════════════════════════════════════════════════════════════════════
+# Bits de conexión N,E,S,O -> carácter de caja
+CAJA_BITS = " │─└││┌├─┘─┴┐┤┬┼"
+N_, E_, S_, O_ = 1, 2, 4, 8
+
+@dataclass
+class LayoutMapa:
+    alto: int; ancho: int; lineas: List[str]
+    nodos: Dict[str, Tuple[int,int]]; etiqueta: int
+
+class MapaMundo:
+    ETIQUETAS = {0: 4, 1: 9, 2: 16}   # ancho de etiqueta por nivel de zoom
+    HUECO = 6                         # columnas entre capas para las aristas
+    
+    def __init__(self):
+        self._cache: Dict[tuple, LayoutMapa] = {}
+    
+    @staticmethod
+    def _capas() -> List[List[str]]:
+        # BFS desde la primera zona; los componentes sueltos van a continuación
+        capas, visto = [], set()
+        for raiz in ZONAS:
+            if raiz in visto: continue
+            base = len(capas)
+            frontera = [raiz]; visto.add(raiz)
+            while frontera:
+                capas.append(frontera)
+                sig = []
+                for zid in frontera:
+                    for c in ZONAS[zid].get("conexiones", []):
+                        if c in ZONAS and c not in visto:
+                            visto.add(c); sig.append(c)
+                frontera = sig
+            if len(capas) == base: capas.append([raiz])
+        return capas
+    
+    def layout(self, zoom: int) -> LayoutMapa:
+        firma = (zoom, tuple((zid, z.get("nombre", ""), tuple(z.get("conexiones", [])))
+                             for zid, z in ZONAS.items()))
+        lay = self._cache.get(firma)
+        if lay is None:
+            lay = self._cache[firma] = self._construir(zoom)
+        return lay
+    
+    def _construir(self, zoom: int) -> LayoutMapa:
+        capas = self._capas()
+        et = self.ETIQUETAS[zoom] + 2
+        capa = {zid: c for c, zs in enumerate(capas) for zid in zs}
+        # Capas pares en filas pares e impares en impares: origen y destino de una arista
+        # nunca comparten fila, así que sus tramos horizontales no se funden
+        fila = {zid: 2*i + c % 2 for c, zs in enumerate(capas) for i, zid in enumerate(zs)}
+        
+        # Cada arista va al hueco a la derecha de su capa menor y tiene su propio carril
+        huecos: List[List[Tuple[str,str]]] = [[] for _ in capas]
+        hechas = set()
+        for a in fila:
+            for b in ZONAS[a].get("conexiones", []):
+                if b not in fila or (b, a) in hechas: continue
+                hechas.add((a, b))
+                o, d = (a, b) if (capa[a], fila[a]) <= (capa[b], fila[b]) else (b, a)
+                huecos[capa[o]].append((o, d))
+        for h in huecos: h.sort(key=lambda e: (fila[e[0]], fila[e[1]]))
+        
+        xs, x = [], 0
+        for h in huecos:
+            xs.append(x); x += et + max(self.HUECO, len(h) + 2)
+        nodos = {zid: (fila[zid], xs[capa[zid]]) for zid in fila}
+        alto = max(fila.values()) + 1
+        ancho = xs[-1] + et + (len(huecos[-1]) + 1 if huecos[-1] else 0)
+        bits = [[0]*ancho for _ in range(alto)]
+        
+        def hlin(y, x1, x2):
+            if x1 > x2: x1, x2 = x2, x1
+            for x in range(x1, x2):
+                bits[y][x] |= E_; bits[y][x+1] |= O_
+        def vlin(x, y1, y2):
+            if y1 > y2: y1, y2 = y2, y1
+            for y in range(y1, y2):
+                bits[y][x] |= S_; bits[y+1][x] |= N_
+        
+        for c, h in enumerate(huecos):
+            for k, (o, d) in enumerate(h):
+                carril = xs[c] + et + 1 + k
+                (yo, xo), (yd, xd) = nodos[o], nodos[d]
+                hlin(yo, xo + et - 1, carril); vlin(carril, yo, yd)
+                hlin(yd, carril, xd + et - 1 if capa[d] == c else xd)
+        
+        lineas = ["".join(CAJA_BITS[b] for b in fila) for fila in bits]
+        return LayoutMapa(alto, ancho, lineas, nodos, et)
+    
+    def pintar(self, ui: UI, lay: LayoutMapa, p: Player):
+        """Vuelca el mapa completo a un pad; luego solo se muestra la ventana visible."""
+        pad = ui.pad(lay.alto, lay.ancho)
+        for y, l in enumerate(lay.lineas):
+            ui.pad_addstr(pad, y, 0, l, ui.col(6))
+        n = lay.etiqueta - 3
+        visitadas = set(p.zonas_visitadas)
+        for zid, (y, x) in lay.nodos.items():
+            nombre = ZONAS[zid].get("nombre", zid).upper()
+            if zid == p.zona: marca, attr = "@", ui.col(4)|curses.A_BOLD
+            elif zid in visitadas: marca, attr = "✓", ui.col(1)
+            else: marca, attr = " ", curses.A_DIM
+            ui.pad_addstr(pad, y, x, f"[{marca}{nombre[:n]:{n}}]", attr)
+        return pad
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# RELOJ DEL MUNDO
+# ═══════════════════════════════════════════════════════════════════════════════
+@dataclass
+class Temporizador:
+    tick: int
+    fn: Callable[[int], None]
+    periodo: int = 0
+    nombre: str = ""
+
+class RelojMundo:
+    """Rueda de temporizadores sobre p.turno. Cada tick solo revisa su casilla (tick % TAM),
+    así que añadir eventos programados no añade trabajo por turno."""
+    TAM = 64
+    
+    def __init__(self, ahora: int = 0):
+        self.ahora = ahora
+        self.rueda: List[List[Temporizador]] = [[] for _ in range(self.TAM)]
+        self.disparos = 0
+    
+    def en(self, tick: int, fn, periodo: int = 0, nombre: str = ""):
+        """Programa fn(tick) en un tick absoluto (como mínimo el siguiente)."""
+        t = Temporizador(max(tick, self.ahora + 1), fn, periodo, nombre)
+        self.rueda[t.tick % self.TAM].append(t)
+    
+    def tras(self, n: int, fn, nombre: str = ""): self.en(self.ahora + n, fn, 0, nombre)
+    
+    def cada(self, periodo: int, fn, fase: int = 0, nombre: str = ""):
+        """Periódico y alineado: dispara en los ticks con tick % periodo == fase."""
+        t = self.ahora + 1
+        self.en(t + (fase - t) % periodo, fn, periodo, nombre)
+    
+    def cancelar(self, nombre: str):
+        for casilla in self.rueda:
+            casilla[:] = [t for t in casilla if t.nombre != nombre]
+    
+    def avanzar_hasta(self, tick: int):
+        while self.ahora < tick:
+            self.ahora += 1
+            casilla = self.rueda[self.ahora % self.TAM]
+            if not casilla: continue
+            vencen = [t for t in casilla if t.tick == self.ahora]
+            if not vencen: continue
+            casilla[:] = [t for t in casilla if t.tick != self.ahora]
+            for t in vencen:
+                self.disparos += 1
+                t.fn(self.ahora)
+                if t.periodo: self.en(self.ahora + t.periodo, t.fn, t.periodo, t.nombre)
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # GAME CONTROLLER
 # ═══════════════════════════════════════════════════════════════════════════════
+@dataclass
+class EstadoJuego:
+    update: Callable[[], None]
+    enter: Optional[Callable[[], None]] = None
+    exit: Optional[Callable[[], None]] = None
+    tiempo: float = 0.0
+    pasos: int = 0
+
 class Game:
-    def __init__(self, scr):
+    def __init__(self, scr, ui: Optional[UI] = None, save: Optional[SaveMgr] = None):
         self.scr = scr
-        self.ui = UI(scr)
+        self.ui = ui or UI(scr)
         self.p: Optional[Player] = None
-        self.save = SaveMgr()
+        self.save = save or abrir_partidas()
         self.combat: Optional[Combat] = None
+        self.reloj = RelojMundo()
+        self.bus = BusEventos()
+        self.bus.suscribir(ZonaEntrada, self._al_entrar_zona)
+        self.bus.suscribir(ItemObtenido, self._progreso_quests)
+        for tipo, fn in LOGROS_EVENTOS: self.bus.suscribir(tipo, lambda ev, fn=fn: fn(self, ev))
+        self.mapa = MapaMundo()
         self.estado = GS.MENU
         self.running = True
-        signal.signal(signal.SIGWINCH, lambda s,f: self.ui.resize())
+        # Tabla de estados: GS -> handlers, más ganchos de transición (anterior, nuevo)
+        self.estados: Dict[GS, EstadoJuego] = {}
+        self.transiciones: List[Callable[[Optional[GS], GS], None]] = []
+        for gs, fn in [(GS.MENU, self._menu), (GS.EXPLOR, self._explorar), (GS.COMBAT, self._combate),
+                       (GS.INV, self._inventario), (GS.MAPA, self._mapa), (GS.PAUSA, self._pausa),
+                       (GS.LVLUP, self._nivel_up), (GS.MUERTE, self._muerte), (GS.FINAL, self._final),
+                       (GS.QUESTS, self._quests), (GS.AYUDA, self._ayuda), (GS.TIENDA, self._tienda)]:
+            self.registrar_estado(gs, fn)
+        if scr is not None:
+            signal.signal(signal.SIGWINCH, lambda s,f: self.ui.marcar_resize())
+    
+    def _poner_jugador(self, p: Player):
+        """Partida nueva o cargada: combate y reloj del mundo parten del turno guardado."""
+        self.p = p
+        p.bus = self.bus
+        self.combat = Combat(self.ui, p)
+        self.reloj = RelojMundo(p.turno)
+        self.reloj.cada(20, self._cambiar_ciclo, nombre="ciclo")
+    
+    def _cambiar_ciclo(self, tick: int):
+        self.p.ciclo = Ciclo.NOCHE if self.p.ciclo == Ciclo.DIA else Ciclo.DIA
     
-    def run(self):
+    def _al_entrar_zona(self, ev: ZonaEntrada):
+        self.p.descansos = 0
+        if ev.nueva:
+            self.p.zonas_visitadas.append(ev.zona)
+            self.p.xp += 25
+    
+    def _progreso_quests(self, ev: ItemObtenido):
+        for qid in self.p.quests_activas:
+            q = QUESTS.get(qid)
+            if q and q.objetivo.get("item") == ev.item.id:
+                self.ui.toast(f"Objetivo listo: {q.titulo}", self.ui.rol("oro"))
+    
+    def registrar_estado(self, gs, update, enter=None, exit=None):
+        self.estados[gs] = EstadoJuego(update, enter, exit)
+    
+    def run(self, teclas: Optional[str] = None):
+        """teclas: fichero donde grabar la sesión (KADATH_TECLAS; solo lo pasa main())."""
+        previo: Optional[GS] = None
         try:
+            if teclas:
+                semilla = random.randrange(2**32)
+                random.seed(semilla)
+                self.ui.rec_teclas = GrabadorTeclas(teclas, semilla, self.ui.my, self.ui.mx, self.save.exportar())
             while self.running:
-                if self.estado == GS.MENU: self._menu()
-                elif self.estado == GS.EXPLOR: self._explorar()
-                elif self.estado == GS.COMBAT: self._combate()
-                elif self.estado == GS.INV: self._inventario()
-                elif self.estado == GS.MAPA: self._mapa()
-                elif self.estado == GS.PAUSA: self._pausa()
-                elif self.estado == GS.LVLUP: self._nivel_up()
-                elif self.estado == GS.MUERTE: self._muerte()
-                elif self.estado == GS.FINAL: self._final()
-                elif self.estado == GS.QUESTS: self._quests()
-                elif self.estado == GS.AYUDA: self._ayuda()
-                elif self.estado == GS.TIENDA: self._tienda()
+                gs = self.estado
+                if gs is not previo:
+                    self._transicion(previo, gs)
+                    previo = gs
+                h = self.estados[gs]
+                self.ui.etiqueta = f"{gs.name} {h.tiempo:.1f}s"
+                self.ui.save_ms = self.save.ms_ultimo
+                t = time.perf_counter()
+                h.update()
+                h.tiempo += time.perf_counter() - t
+                h.pasos += 1
+        except EntradaAgotada:
+            self.running = False
         except Exception as e:
             self._error(e)
+        finally:
+            if self.ui.rec_teclas:
+                self.ui.rec_teclas.cerrar(GrabadorTeclas.huella(self.p))
+                self.ui.rec_teclas = None
+            self.save.cerrar()
+            self.ui.cerrar()
+    
+    def _transicion(self, previo: Optional[GS], nuevo: GS):
+        if previo is not None and self.estados[previo].exit: self.estados[previo].exit()
+        for hook in self.transiciones: hook(previo, nuevo)
+        self.ui.entrada.contexto = nuevo.name
+        if self.estados[nuevo].enter: self.estados[nuevo].enter()
+    
+    def perfil(self) -> Dict[str, dict]:
+        """Tiempo acumulado por estado (incluye la espera de teclas dentro del estado)."""
+        d = {gs.name: {"segundos": round(h.tiempo, 4), "pasos": h.pasos}
+             for gs, h in sorted(self.estados.items(), key=lambda e: -e[1].tiempo) if h.pasos}
+        d["eventos"] = dict(self.bus.conteo)
+        return d
     
     def _error(self, e):
         try:
             self.ui.clear()
             self.ui.caja(5, 5, 10, 60, "ERROR")
             self.ui.addstr(8, 10, f"Error: {str(e)[:45]}")
-            if self.p: self.save.guardar(self.p, "crash")
+            if self.p: self.save.guardar(self.p, "crash", esperar=True)
             self.ui.addstr(10, 10, "Guardado de emergencia intentado.")
             self.ui.addstr(12, 10, "Pulsa tecla para salir...")
             self.ui.refresh()
@@ -749,8 +2613,7 @@ class Game:
         
         k = self.ui.getch()
         if k in [ord('n'), ord('N')]:
-            self.p = Player()
-            self.combat = Combat(self.ui, self.p)
+            self._poner_jugador(Player())
             self.save.guardar(self.p, "auto")
             self._intro()
             self.estado = GS.EXPLOR
@@ -804,61 +2667,62 @@ class Game:
             if idx < len(slots) and slots[idx].get("existe") and not slots[idx].get("corrupto"):
                 p = self.save.cargar(slots[idx]["nombre"])
                 if p:
-                    self.p = p
-                    self.combat = Combat(self.ui, self.p)
+                    self._poner_jugador(p)
                     self.estado = GS.EXPLOR
     
     def _explorar(self):
         z = ZONAS.get(self.p.zona, {})
-        
-        if self.p.zona not in self.p.zonas_visitadas:
-            self.p.zonas_visitadas.append(self.p.zona)
-            self.p.xp += 25
-            self.p.descansos = 0
-        
         self._dibujar_explor(z)
         
         k = self.ui.getch()
-        
-        if k == ord('1'): self._explorar_zona(z)
-        elif k == ord('2'): self._viajar(z)
-        elif k == ord('3'): self._descansar(z)
-        elif k == ord('4') and z.get("tienda"): self.estado = GS.TIENDA
-        elif k == ord('5') and z.get("npcs"): self._hablar_npc(z)
-        elif k in [ord('i'), ord('I')]: self.estado = GS.INV
-        elif k in [ord('m'), ord('M')]: self.estado = GS.MAPA
-        elif k in [ord('p'), ord('P')]: self.estado = GS.PAUSA
-        elif k in [ord('q'), ord('Q')]: self.estado = GS.QUESTS
-        elif k == ord('?'): self.estado = GS.AYUDA
+        if k == curses.KEY_RESIZE: return   # el siguiente frame redibuja; no cuenta como turno
+        a = self.ui.entrada.accion("explorar", k)
+        
+        if a == "explorar": self._explorar_zona(z)
+        elif a == "viajar": self._viajar(z)
+        elif a == "descansar": self._descansar(z)
+        elif a == "tienda" and z.get("tienda"): self.estado = GS.TIENDA
+        elif a == "hablar" and z.get("npcs"): self._hablar_npc(z)
+        elif a == "inventario": self.estado = GS.INV
+        elif a == "mapa": self.estado = GS.MAPA
+        elif a == "pausa": self.estado = GS.PAUSA
+        elif a == "quests": self.estado = GS.QUESTS
+        elif a == "ayuda": self.estado = GS.AYUDA
+        elif a == "debug": self.ui.debug = not self.ui.debug
         
         if self.p.puede_subir(): self.estado = GS.LVLUP
         if self.p.vida <= 0: self.estado = GS.MUERTE
         if self.p.cordura <= 0: self.estado = GS.FINAL
         
         self.p.turno += 1
-        if self.p.turno % 20 == 0:
-            self.p.ciclo = Ciclo.NOCHE if self.p.ciclo == Ciclo.DIA else Ciclo.DIA
-        
-        self._check_logros()
+        self.reloj.avanzar_hasta(self.p.turno)
+        if self.estado not in (GS.MUERTE, GS.FINAL): self.save.anotar(self.p)
+    
+    def _layout_explor(self, z: dict) -> dict:
+        hx = self.ui.mx - 22
+        arte = [l[:min(60, hx - 3)] for l in z.get("ascii", "").split("\n")[:6]]
+        return {"hx": hx, "arte": arte, "y_desc": 3 + len(arte),
+                "desc": envolver(z.get("desc", ""), min(70, hx - 4), True)[:3], "y_menu": self.ui.my - 5}
     
     def _dibujar_explor(self, z: dict):
         self.ui.clear()
+        lay = self.ui.layout(("explor", self.p.zona), lambda: self._layout_explor(z))
         
         nombre = z.get("nombre", "???")
         self.ui.addstr(0, 2, f"═══ {nombre} ═══", self.ui.col(4)|curses.A_BOLD)
         
         y = 2
-        for line in z.get("ascii", "").split("\n")[:6]:
-            self.ui.addstr(y, 2, line[:60])
+        for line in lay["arte"]:
+            self.ui.addstr(y, 2, line)
             y += 1
         
-        y += 1
-        for line in z.get("desc", "").split("\n")[:3]:
-            self.ui.addstr(y, 2, line[:70], self.ui.col(6))
+        y = lay["y_desc"]
+        for line in lay["desc"]:
+            self.ui.addstr(y, 2, line, self.ui.col(6))
             y += 1
         
         # HUD derecha
-        hx = self.ui.mx - 22
+        hx = lay["hx"]
         self.ui.addstr(1, hx, "VIDA:    "); self.ui.barra(1, hx+9, self.p.vida, self.p.vida_max, 8, 1)
         self.ui.addstr(2, hx, "CORDURA: "); self.ui.barra(2, hx+9, self.p.cordura, self.p.cordura_max, 8, 2)
         self.ui.addstr(3, hx, "VOLUNTAD:"); self.ui.barra(3, hx+9, self.p.voluntad, self.p.voluntad_max, 8, 3)
@@ -874,7 +2738,7 @@ class Game:
         self.ui.addstr(10, hx, f"ARM: {arm[:13]}")
         
         # Menu
-        y = self.ui.my - 5
+        y = lay["y_menu"]
         self.ui.addstr(y, 2, "[1] Explorar  [2] Viajar  [3] Descansar", self.ui.col(4))
         y += 1
         if z.get("tienda"): self.ui.addstr(y, 2, "[4] Tienda")
@@ -895,18 +2759,15 @@ class Game:
         for eid, prob in enc:
             if random.random() < prob * mod:
                 if eid in ENEMIGOS:
-                    import copy
-                    self.combat.e = copy.deepcopy(ENEMIGOS[eid])
+                    self.combat.e = ENEMIGOS[eid].nuevo()
                     self.estado = GS.COMBAT
                     return
         
         # Objetos
         for iid, loc in z.get("objetos", []):
             if not self.p.tiene_item(iid):
-                import copy
                 item = None
-                if iid in CONSUMIBLES: item = copy.deepcopy(CONSUMIBLES[iid])
-                elif iid in MISION_ITEMS: item = copy.deepcopy(MISION_ITEMS[iid])
+                if iid in CONSUMIBLES or iid in MISION_ITEMS: item = DEF_ITEMS[iid].ejemplar()
                 
                 if item and self.p.add_item(item):
                     self.ui.clear()
@@ -914,12 +2775,10 @@ class Game:
                     self.ui.addstr(10, 15, f"{item.nombre}")
                     self.ui.addstr(11, 15, f"En: {loc}")
                     self.ui.refresh()
-                    time.sleep(1.5)
+                    self.ui.pausa(1.5)
                     return
         
-        self.ui.addstr(self.ui.my-3, 2, "Exploras pero no encuentras nada...")
-        self.ui.refresh()
-        time.sleep(1)
+        self.ui.toast("Exploras pero no encuentras nada...")
     
     def _viajar(self, z: dict):
         conex = z.get("conexiones", [])
@@ -943,21 +2802,15 @@ class Game:
         if k >= ord('1') and k <= ord('9'):
             idx = k - ord('1')
             if idx < len(dests):
-                self.p.zona = dests[idx][0]
-                self.p.descansos = 0
-                self.save.guardar(self.p, "auto")
+                self.p.ir_a(dests[idx][0])
     
     def _descansar(self, z: dict):
         if not z.get("segura") and not z.get("posada"):
-            self.ui.addstr(self.ui.my-3, 2, "Lugar no seguro para descansar...")
-            self.ui.refresh()
-            time.sleep(1)
+            self.ui.toast("Lugar no seguro para descansar...")
             return
         
         if self.p.descansos >= 2 and not z.get("posada"):
-            self.ui.addstr(self.ui.my-3, 2, "Ya descansaste suficiente aquí.")
-            self.ui.refresh()
-            time.sleep(1)
+            self.ui.toast("Ya descansaste suficiente aquí.")
             return
         
         self.p.mod_stat("cordura", 15)
@@ -965,9 +2818,7 @@ class Game:
         self.p.mod_stat("vida", 5)
         self.p.descansos += 1
         
-        self.ui.addstr(self.ui.my-3, 2, "Descansas y recuperas fuerzas...")
-        self.ui.refresh()
-        time.sleep(1)
+        self.ui.toast("Descansas y recuperas fuerzas...")
     
     def _hablar_npc(self, z: dict):
         npcs = z.get("npcs", [])
@@ -990,9 +2841,7 @@ class Game:
     
     def _dialogo_menes(self):
         self.ui.addstr(2, 2, "═══ Menes el Felino ═══", self.ui.col(4))
-        self.ui.addstr(4, 4, "Bienvenido a Ulthar, soñador.")
-        
-        y = 6
+        y = self.ui.parrafo(4, 4, "Bienvenido a Ulthar, soñador.") + 1
         self.ui.addstr(y, 4, "[1] Información sobre Kadath")
         y += 1
         self.ui.addstr(y, 4, "[2] Ver tienda")
@@ -1019,20 +2868,14 @@ class Game:
                 self.p.mod_stat("oro", 50)
                 self.p.xp += 80
                 self.p.flags["GATOS_ALIADOS"] = True
-                self.ui.addstr(y+3, 4, "¡Quest completada! +50 oro, +80 XP", self.ui.col(1))
-                self.ui.refresh()
-                time.sleep(2)
+                self.ui.toast("¡Quest completada! +50 oro, +80 XP", self.ui.col(1), 2)
             elif "q01" not in self.p.quests_activas:
                 self.p.quests_activas.append("q01")
-                self.ui.addstr(y+3, 4, "¡Nueva quest: El Favor de los Gatos!", self.ui.col(4))
-                self.ui.refresh()
-                time.sleep(2)
+                self.ui.toast("¡Nueva quest: El Favor de los Gatos!", self.ui.col(4), 2)
     
     def _dialogo_zoog(self):
         self.ui.addstr(2, 2, "═══ Zoog Gris ═══", self.ui.col(4))
-        self.ui.addstr(4, 4, "¿Qué quieres, soñador?")
-        
-        y = 6
+        y = self.ui.parrafo(4, 4, "¿Qué quieres, soñador?") + 1
         self.ui.addstr(y, 4, "[1] Comerciar")
         y += 1
         
@@ -1073,15 +2916,12 @@ class Game:
                 self.p.xp += 60
                 self.p.mapa_frags += 1
                 self.p.flags["GATOS_HOSTILES"] = True
-                import copy
-                self.p.add_item(copy.deepcopy(MISION_ITEMS["mapa_frag"]))
+                self.p.add_item(MISION_ITEMS["mapa_frag"].ejemplar())
                 break
     
     def _dialogo_arash(self):
         self.ui.addstr(2, 2, "═══ Capitán Arash ═══", self.ui.col(4))
-        self.ui.addstr(4, 4, "Soy el Capitán Arash. ¿Buscas pasaje?")
-        
-        y = 6
+        y = self.ui.parrafo(4, 4, "Soy el Capitán Arash. ¿Buscas pasaje?") + 1
         if "q03" not in self.p.quests_activas and "q03" not in self.p.quests_completas:
             self.ui.addstr(y, 4, "[1] ¿Necesitas algo? (Quest)")
             y += 1
@@ -1101,14 +2941,10 @@ class Game:
                 self.p.mod_stat("oro", 100)
                 self.p.xp += 100
                 self.p.flags["RUTA_SEGURA"] = True
-                self.ui.addstr(y+3, 4, "¡Quest completada!", self.ui.col(1))
-                self.ui.refresh()
-                time.sleep(2)
+                self.ui.toast("¡Quest completada!", self.ui.col(1), 2)
             elif "q03" not in self.p.quests_activas:
                 self.p.quests_activas.append("q03")
-                self.ui.addstr(y+3, 4, "¡Nueva quest!", self.ui.col(4))
-                self.ui.refresh()
-                time.sleep(2)
+                self.ui.toast("¡Nueva quest!", self.ui.col(4), 2)
     
     def _combate(self):
         if self.combat and self.combat.e:
@@ -1130,7 +2966,7 @@ class Game:
             
             y = 3
             for i, it in enumerate(self.p.inventario):
-                self.ui.addstr(y, 4, f"[{i+1}] [{it.tipo[0]}] {it.nombre}")
+                self.ui.addstr(y, 4, f"[{i+1}] [{it.tipo[0]}] {it.nombre}" + (f" x{it.cantidad}" if it.cantidad > 1 else ""))
                 y += 1
             
             y += 1
@@ -1162,15 +2998,11 @@ class Game:
             if idx < len(self.p.inventario):
                 it = self.p.inventario[idx]
                 if it.tipo == "ARMA":
-                    if self.p.arma and self.p.arma.id != "punos":
-                        self.p.inventario.append(self.p.arma)
-                    self.p.arma = it
-                    self.p.inventario.pop(idx)
+                    self.p.arma, viejo = self.p.inventario.sacar(idx), self.p.arma
+                    if viejo and viejo.id != "punos": self.p.inventario.anadir(viejo, forzar=True)
                 elif it.tipo == "ARMADURA":
-                    if self.p.armadura and self.p.armadura.id != "sin_armadura":
-                        self.p.inventario.append(self.p.armadura)
-                    self.p.armadura = it
-                    self.p.inventario.pop(idx)
+                    self.p.armadura, viejo = self.p.inventario.sacar(idx), self.p.armadura
+                    if viejo and viejo.id != "sin_armadura": self.p.inventario.anadir(viejo, forzar=True)
     
     def _usar(self):
         self.ui.addstr(self.ui.my-2, 2, "Número a usar (0 cancelar): ")
@@ -1183,7 +3015,7 @@ class Game:
                 if it.usable:
                     for stat, val in it.efecto.items():
                         self.p.mod_stat(stat, val)
-                    self.p.inventario.pop(idx)
+                    self.p.inventario.sacar(idx)
     
     def _descartar(self):
         self.ui.addstr(self.ui.my-2, 2, "Número a descartar (0 cancelar): ")
@@ -1194,10 +3026,11 @@ class Game:
             if idx < len(self.p.inventario):
                 it = self.p.inventario[idx]
                 if it.tipo not in ["MISION", "CLAVE"]:
-                    self.p.inventario.pop(idx)
+                    self.p.inventario.sacar(idx)
     
     def _tienda(self):
-        catalogo = TIENDA_CATALOGO.get(self.p.zona, [])
+        items = [DEF_ITEMS[iid] for iid in TIENDA_CATALOGO.get(self.p.zona, [])
+                 if iid in CONSUMIBLES or iid in ARMAS or iid in ARMADURAS]
         
         while True:
             self.ui.clear()
@@ -1206,21 +3039,10 @@ class Game:
             self.ui.addstr(1, 2, f"Tu oro: {self.p.oro} ◈")
             
             y = 3
-            items = []
-            for iid in catalogo:
-                it = None
-                if iid in CONSUMIBLES:
-                    import copy; it = copy.deepcopy(CONSUMIBLES[iid])
-                elif iid in ARMAS:
-                    import copy; it = copy.deepcopy(ARMAS[iid])
-                elif iid in ARMADURAS:
-                    import copy; it = copy.deepcopy(ARMADURAS[iid])
-                
-                if it:
-                    items.append(it)
-                    color = 0 if it.valor_c <= self.p.oro else self.ui.col(5)
-                    self.ui.addstr(y, 4, f"[{len(items)}] {it.nombre:20} - {it.valor_c} ◈", color)
-                    y += 1
+            for i, it in enumerate(items):
+                color = 0 if it.valor_c <= self.p.oro else self.ui.col(5)
+                self.ui.addstr(y, 4, f"[{i+1}] {it.nombre:20} - {it.valor_c} ◈", color)
+                y += 1
             
             self.ui.addstr(y+1, 4, "[X] Salir")
             self.ui.refresh()
@@ -1232,45 +3054,50 @@ class Game:
                 idx = k - ord('1')
                 if idx < len(items):
                     it = items[idx]
-                    if it.valor_c <= self.p.oro and len(self.p.inventario) < MAX_INV:
+                    if it.valor_c <= self.p.oro and self.p.inventario.cabe(it):
                         self.p.mod_stat("oro", -it.valor_c)
-                        self.p.add_item(it)
+                        self.p.add_item(it.ejemplar())
         
         self.estado = GS.EXPLOR
     
     def _mapa(self):
-        self.ui.clear()
-        self.ui.addstr(0, 2, "═══ MAPA DEL MUNDO ═══", self.ui.col(4))
-        
-        mapa = """
-    [1:ULTHAR★]━━━[2:ZOOG]━━━[3:DYLATH]
-        │               │          │
-     [6:CEL★]       [4:HUMO]   [7:ORIAB]
-        │               │          │
-                    [5:ZAK]   [8:INQUANOK]
-                                   │
-                              [9:LENG]
-                                   │
-                             [10:KADATH]
-        """
-        y = 3
-        for line in mapa.split("\n"):
-            self.ui.addstr(y, 2, line)
-            y += 1
-        
-        zn = ZONAS.get(self.p.zona, {}).get("nombre", "???")
-        self.ui.addstr(y+1, 4, f"Ubicación: {zn}", self.ui.col(4))
-        self.ui.addstr(y+2, 4, f"Fragmentos mapa: {self.p.mapa_frags}/3")
-        self.ui.addstr(self.ui.my-2, 2, "Pulsa tecla para volver...")
-        self.ui.refresh()
-        self.ui.wait()
+        zoom, pad, vista = 1, None, None
+        vy, vx = 2, 1
+        while True:
+            self.ui.clear()
+            lay = self.mapa.layout(zoom)
+            vh, vw = max(1, self.ui.my - 7), max(1, self.ui.mx - 2)
+            if vista != zoom:
+                pad, vista = self.mapa.pintar(self.ui, lay, self.p), zoom
+                cy, cx = lay.nodos.get(self.p.zona, (0, 0))
+                py, px = cy - vh // 2, cx - vw // 2
+            py = max(0, min(py, lay.alto - vh)); px = max(0, min(px, lay.ancho - vw))
+            
+            self.ui.addstr(0, 2, "═══ MAPA DEL MUNDO ═══", self.ui.col(4))
+            zn = ZONAS.get(self.p.zona, {}).get("nombre", "???")
+            self.ui.addstr(self.ui.my-4, 4, f"Ubicación: {zn}", self.ui.col(4))
+            self.ui.addstr(self.ui.my-3, 4, f"Fragmentos mapa: {self.p.mapa_frags}/3  "
+                                            f"Visitadas: {len(self.p.zonas_visitadas)}/{len(ZONAS)}")
+            self.ui.addstr(self.ui.my-2, 2, "[Flechas/WASD] Mover  [+/-] Zoom  [X] Volver")
+            self.ui.ver_pad(pad, py, px, vy, vx, vh, vw)
+            self.ui.refresh()
+            
+            k = self.ui.getch()
+            if k in [curses.KEY_UP, ord('w'), ord('W')]: py -= 2
+            elif k in [curses.KEY_DOWN, ord('s'), ord('S')]: py += 2
+            elif k in [curses.KEY_LEFT, ord('a'), ord('A')]: px -= 8
+            elif k in [curses.KEY_RIGHT, ord('d'), ord('D')]: px += 8
+            elif k in [ord('+'), ord('=')]: zoom = min(2, zoom + 1)
+            elif k == ord('-'): zoom = max(0, zoom - 1)
+            else: break
         self.estado = GS.EXPLOR
     
     def _pausa(self):
         self.ui.clear()
         self.ui.caja(5, 20, 12, 30, "⏸ PAUSA")
         
-        opts = ["[G] Guardar", "[M] Mapa", "[Q] Quests", "[?] Ayuda", "[X] Volver", "[S] Salir al menú"]
+        opts = ["[G] Guardar", "[M] Mapa", "[Q] Quests", "[?] Ayuda", "[X] Volver", "[S] Salir al menú",
+                f"[R] Modo rápido: {'SÍ' if self.ui.rapido else 'NO'}"]
         y = 7
         for o in opts:
             self.ui.addstr(y, 25, o)
@@ -1291,6 +3118,8 @@ class Game:
         elif k in [ord('s'), ord('S')]:
             self.save.guardar(self.p, "auto")
             self.estado = GS.MENU
+        elif k in [ord('r'), ord('R')]:
+            self.ui.rapido = not self.ui.rapido
     
     def _guardar_menu(self):
         self.ui.clear()
@@ -1311,12 +3140,10 @@ class Game:
         k = self.ui.getch()
         if k >= ord('1') and k <= ord('3'):
             slot = f"slot_{k - ord('0')}"
-            if self.save.guardar(self.p, slot):
-                self.ui.addstr(y+3, 4, "¡Guardado!", self.ui.col(1))
+            if self.save.guardar(self.p, slot, esperar=True):
+                self.ui.toast("¡Guardado!", self.ui.col(1))
             else:
-                self.ui.addstr(y+3, 4, "Error", self.ui.col(5))
-            self.ui.refresh()
-            time.sleep(1)
+                self.ui.toast("Error al guardar", self.ui.col(5))
     
     def _nivel_up(self):
         self.ui.clear()
@@ -1324,7 +3151,7 @@ class Game:
         self.ui.addstr(10, 22, "¡SUBIDA DE NIVEL!", self.ui.col(4)|curses.A_BOLD)
         self.ui.addstr(12, 20, f"Nivel {self.p.nivel} → {self.p.nivel+1}")
         self.ui.refresh()
-        time.sleep(1)
+        self.ui.pausa(1)
         
         self.p.subir_nivel()
         
@@ -1332,7 +3159,7 @@ class Game:
             h = HABILIDADES[self.p.nivel]
             self.ui.addstr(14, 15, f"¡Nueva habilidad: {h[1]}!", self.ui.col(1))
             self.ui.refresh()
-            time.sleep(1.5)
+            self.ui.pausa(1.5)
         
         # Elegir mejora
         self.ui.clear()
@@ -1388,14 +3215,12 @@ class Game:
                 self.p.mod_stat("oro", -coste)
                 self.p.vida = int(self.p.vida_max * 0.3)
                 self.p.cordura = int(self.p.cordura_max * 0.3)
-                self.p.zona = "zona_1"
+                self.p.ir_a("zona_1")
                 self.estado = GS.EXPLOR
                 break
             elif k == ord('2'):
                 p = self.save.cargar("auto")
-                if p:
-                    self.p = p
-                    self.combat = Combat(self.ui, self.p)
+                if p: self._poner_jugador(p)
                 self.estado = GS.EXPLOR
                 break
             elif k == ord('3'):
@@ -1430,33 +3255,37 @@ class Game:
         self.estado = GS.MENU
     
     def _quests(self):
-        self.ui.clear()
-        self.ui.addstr(0, 2, "═══ QUESTS ═══", self.ui.col(4))
-        
-        y = 2
+        ancho = self.ui.mx - 10
+        lineas: List[Tuple[str, int]] = []
         if not self.p.quests_activas:
-            self.ui.addstr(y, 4, "No tienes quests activas.")
-        else:
-            for qid in self.p.quests_activas:
-                q = QUESTS.get(qid)
-                if q:
-                    self.ui.addstr(y, 4, f"• {q.titulo}", self.ui.col(4))
-                    y += 1
-                    self.ui.addstr(y, 6, q.desc[:60])
-                    y += 2
-        
-        y += 1
-        self.ui.addstr(y, 2, "── COMPLETADAS ──", self.ui.col(6))
-        y += 1
+            lineas.append(("  No tienes quests activas.", 0))
+        for qid in self.p.quests_activas:
+            q = QUESTS.get(qid)
+            if q:
+                lineas.append((f"  • {q.titulo}", self.ui.col(4)))
+                lineas += [(f"    {l}", 0) for l in envolver(q.desc, ancho, True)]
+                lineas.append(("", 0))
+        lineas.append(("", 0))
+        lineas.append(("── COMPLETADAS ──", self.ui.col(6)))
         for qid in self.p.quests_completas:
             q = QUESTS.get(qid)
             if q:
-                self.ui.addstr(y, 4, f"✓ {q.titulo}", self.ui.col(1))
-                y += 1
+                lineas.append((f"  ✓ {q.titulo}", self.ui.col(1)))
         
-        self.ui.addstr(self.ui.my-2, 2, "Pulsa tecla para volver...")
-        self.ui.refresh()
-        self.ui.wait()
+        paginas = paginar(lineas, self.ui.my - 5)
+        for n, pag in enumerate(paginas):
+            self.ui.clear()
+            self.ui.addstr(0, 2, "═══ QUESTS ═══", self.ui.col(4))
+            if len(paginas) > 1:
+                self.ui.addstr(0, 20, f"({n+1}/{len(paginas)})")
+            y = 2
+            for texto, attr in pag:
+                self.ui.addstr(y, 2, texto, attr)
+                y += 1
+            self.ui.addstr(self.ui.my-2, 2, "Pulsa tecla para volver..." if n == len(paginas)-1
+                                            else "Pulsa tecla para continuar...")
+            self.ui.refresh()
+            self.ui.wait()
         self.estado = GS.EXPLOR
     
     def _ayuda(self):
@@ -1468,6 +3297,8 @@ class Game:
             "[1-5] Acciones del menú",
             "[I] Inventario  [M] Mapa  [P] Pausa",
             "[Q] Quests  [?] Ayuda",
+            "[F2] Captura de pantalla  [F3] Overlay de rendimiento",
+            "[F5] Grabar macro  [F6] Repetirla  [F7] Explorar hasta encuentro",
             "",
             "CONSEJOS:",
             "• Explora para encontrar objetos",
@@ -1488,20 +3319,303 @@ class Game:
         self.ui.wait()
         self.estado = GS.EXPLOR
     
-    def _check_logros(self):
-        if self.p.oro >= 500 and "logro_03" not in self.p.logros:
-            self.p.logros.append("logro_03")
-        
-        if self.p.zona == "zona_7" and self.p.cordura >= 90 and "logro_04" not in self.p.logros:
-            self.p.logros.append("logro_04")
+
+# Logros por evento: (tipo, fn(game, ev)); solo se evalúan cuando ocurre algo relevante
+def _logro(p: Player, lid: str):
+    if lid not in p.logros: p.logros.append(lid)
+
+def _logro_cordura_kadath(g: 'Game', ev):
+    if g.p.zona == "zona_7" and g.p.cordura >= 90: _logro(g.p, "logro_04")
+
+LOGROS_EVENTOS = [
+    (EnemigoDerrotado, lambda g, ev: _logro(g.p, "logro_01")),
+    (StatCambiado, lambda g, ev: ev.stat == "oro" and ev.ahora >= 500 and _logro(g.p, "logro_03")),
+    (ZonaEntrada, _logro_cordura_kadath),
+    (StatCambiado, lambda g, ev: ev.stat == "cordura" and _logro_cordura_kadath(g, ev)),
+]
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# BUCLE ASYNCIO (varias sesiones por proceso)
+# ═══════════════════════════════════════════════════════════════════════════════
+AUTOSAVE_SEG = int(os.environ.get("KADATH_AUTOSAVE", "60"))
+AMBIENTE = [
+    "Un gato negro te observa desde un tejado...",
+    "Un viento frío trae susurros de Leng.",
+    "Por un instante, las estrellas parecen moverse.",
+    "Oyes un aleteo sin cuerpo sobre tu cabeza.",
+]
+IAC, SB, SE, NAWS = 255, 250, 240, 31
+TELNET_INICIO = bytes([IAC, 251, 1, IAC, 251, 3, IAC, 253, NAWS])   # WILL ECHO, WILL SGA, DO NAWS
+TELNET_ESC = {b"[A": curses.KEY_UP, b"[B": curses.KEY_DOWN, b"[C": curses.KEY_RIGHT, b"[D": curses.KEY_LEFT,
+              b"OP": curses.KEY_F1, b"OQ": curses.KEY_F2, b"OR": curses.KEY_F3, b"OS": curses.KEY_F4,
+              b"[15~": curses.KEY_F5, b"[17~": curses.KEY_F6, b"[18~": curses.KEY_F7}
+
+class _SalidaAsync:
+    """Flujo de bytes que el hilo del juego usa para escribir en un transporte asyncio."""
+    def __init__(self, loop, writer):
+        self.loop, self.writer = loop, writer
+    def write(self, datos: bytes): self.loop.call_soon_threadsafe(self.writer.write, datos)
+
+class UIAsync(AnsiUI):
+    """AnsiUI cuya entrada es una asyncio.Queue. El juego corre en su propio hilo y, cuando
+    pide una tecla, espera el futuro de la cola sin bloquear el bucle de eventos. Mientras
+    espera suelta `lock`, que es cuando las tareas de fondo pueden tocar partida y pantalla."""
+    def __init__(self, loop, salida, my: int = 24, mx: int = 80):
+        super().__init__(salida, my, mx)
+        self.loop = loop
+        self.cola_async: asyncio.Queue = asyncio.Queue()
+        self.lock = threading.RLock()
+        self._tam: Optional[Tuple[int,int]] = None
+    
+    def _esperar(self, timeout: Optional[float]):
+        fut = asyncio.run_coroutine_threadsafe(asyncio.wait_for(self.cola_async.get(), timeout), self.loop)
+        self.lock.release()
+        try: k = fut.result()
+        except (asyncio.TimeoutError, TimeoutError): return -1
+        finally: self.lock.acquire()
+        if k is None: raise EntradaAgotada()
+        return k
+    
+    def _leer(self): return self._esperar(None)
+    def _leer_timeout(self, ms: int): return self._esperar(ms / 1000)
+    def _tecla_disponible(self) -> bool: return not self.cola_async.empty()
+    pausa = UI.pausa
+    
+    def pedir_tamano(self, my: int, mx: int):
+        self._tam = (my, mx)
+        self.marcar_resize()
+    
+    def resize(self, my: Optional[int] = None, mx: Optional[int] = None):
+        if my is None and self._tam: my, mx = self._tam
+        super().resize(my, mx)
+
+class SesionAsync:
+    def __init__(self, reader, writer, nombre: str):
+        self.reader, self.writer = reader, writer
+        self.loop = asyncio.get_running_loop()
+        self.ui = UIAsync(self.loop, _SalidaAsync(self.loop, writer))
+        self.game = Game(None, self.ui, abrir_partidas(nombre, SAVE_DIR / "jugadores" / nombre))
+        self._buf = b""
+    
+    async def ejecutar(self):
+        fin = self.loop.create_future()
+        def hilo():
+            with self.ui.lock:
+                try: self.game.run()
+                finally: self.loop.call_soon_threadsafe(fin.set_result, None)
+        threading.Thread(target=hilo, daemon=True).start()
+        tareas = [asyncio.create_task(t) for t in (self._entrada(), self._autoguardado(), self._ambiente())]
+        try: await fin
+        finally:
+            for t in tareas: t.cancel()
+            self.writer.close()
+    
+    async def _entrada(self):
+        try:
+            while True:
+                datos = await self.reader.read(1024)
+                if not datos: break
+                for k in self._decodificar(datos): await self.ui.cola_async.put(k)
+        finally:
+            await self.ui.cola_async.put(None)
+    
+    def _decodificar(self, datos: bytes) -> List[int]:
+        b, out, i = self._buf + datos, [], 0
+        while i < len(b):
+            c = b[i]
+            if c == IAC:
+                if i + 1 >= len(b): break
+                if b[i+1] == SB:
+                    fin = b.find(bytes([IAC, SE]), i)
+                    if fin < 0: break
+                    if b[i+2] == NAWS and fin - i >= 7:
+                        self.ui.pedir_tamano(b[i+5] << 8 | b[i+6], b[i+3] << 8 | b[i+4])
+                    i = fin + 2
+                else:
+                    i += 3 if b[i+1] >= 251 else 2
+                continue
+            if c == 27:
+                for seq, k in TELNET_ESC.items():
+                    if b.startswith(seq, i + 1):
+                        out.append(k); i += 1 + len(seq); break
+                else:
+                    if i + 1 >= len(b): break
+                    out.append(27); i += 1
+                continue
+            if c == 13:
+                out.append(10)
+                i += 2 if i + 1 < len(b) and b[i+1] in (0, 10) else 1
+                continue
+            out.append(c); i += 1
+        self._buf = b[i:]
+        return out
+    
+    async def _con_partida(self, fn):
+        """Ejecuta fn en un hilo mientras el juego espera entrada (partida consistente)."""
+        def tarea():
+            with self.ui.lock:
+                if self.game.p and self.game.running: fn()
+        await asyncio.to_thread(tarea)
+    
+    async def _autoguardado(self):
+        while True:
+            await asyncio.sleep(AUTOSAVE_SEG)
+            await self._con_partida(lambda: self.game.save.guardar(self.game.p, "auto"))
+    
+    async def _ambiente(self):
+        while True:
+            await asyncio.sleep(random.uniform(30, 90))
+            if self.game.estado == GS.EXPLOR:
+                await self._mensaje(random.choice(AMBIENTE), 3)
+    
+    async def _mensaje(self, texto: str, dur: float):
+        def mostrar():
+            self.ui.toast(texto, self.ui.rol("info"), dur)
+            self.ui.refresh()
+        def quitar():
+            if self.ui._toast_visible and self.ui._toast_vigente() is None:
+                self.ui._quitar_toast(self.ui.my - 3)
+                self.ui._refrescar()
+        await self._con_partida(mostrar)
+        await asyncio.sleep(dur)
+        await self._con_partida(quitar)
+
+async def _pedir_nombre(reader, writer) -> Optional[str]:
+    writer.write("KADATH — nombre del soñador: ".encode("utf-8"))
+    await writer.drain()
+    linea = await reader.readline()
+    nombre = re.sub(r"[^\w-]", "", linea.decode("utf-8", "ignore"))[:24]
+    return nombre or None
+
+async def servir(puerto: int, host: str = "0.0.0.0"):
+    async def conexion(reader, writer):
+        nombre = await _pedir_nombre(reader, writer)
+        if not nombre:
+            writer.close(); return
+        writer.write(TELNET_INICIO)
+        await SesionAsync(reader, writer, nombre).ejecutar()
+    srv = await asyncio.start_server(conexion, host, puerto)
+    async with srv:
+        await srv.serve_forever()
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # MAIN
 # ═══════════════════════════════════════════════════════════════════════════════
+def bench_ansi(frames: int = 300):
+    """Bytes por frame de _dibujar_explor y Combat._dibujar: repintado completo vs delta."""
+    random.seed(0)
+    ui = VirtualUI()
+    game = Game(None, ui)
+    game._poner_jugador(Player())
+    render = RenderANSI()
+    
+    def medir(dibujar):
+        total = delta = 0
+        render.invalidar()
+        for i in range(frames):
+            dibujar(i)
+            total += len(RenderANSI().volcar(ui.pantalla))
+            delta += len(render.volcar(ui.pantalla))
+        return total / frames, delta / frames
+    
+    zonas = list(ZONAS)
+    def explor(i):
+        game.p.turno = i
+        game.p.oro = 20 + i % 7
+        if i % 25 == 0: game.p.zona = zonas[(i // 25) % len(zonas)]
+        game._dibujar_explor(ZONAS[game.p.zona])
+    
+    cb = game.combat
+    def combate(i):
+        if i % 12 == 0:
+            cb.e = ENEMIGOS["ghul"].nuevo()
+            cb.log = [f"¡{cb.e.nombre} te ataca!"]
+        cb.turno = i % 12 + 1
+        cb.e.vida = max(0, cb.e.vida - random.randint(1, 5))
+        game.p.vida = max(1, game.p.vida - random.randint(0, 3))
+        cb.log.append(f"Atacas con {game.p.arma.nombre}! {random.randint(3, 8)} daño")
+        cb._dibujar()
+    
+    for nombre, fn in [("_dibujar_explor", explor), ("Combat._dibujar", combate)]:
+        full, dlt = medir(fn)
+        print(f"{nombre:18} completo: {full:7.0f} B/frame  delta: {dlt:6.0f} B/frame  ({dlt/full:5.1%})")
+
+def repetir_sesiones(rutas: List[str]):
+    """Reproduce grabaciones de KADATH_TECLAS sin terminal ni pausas y comprueba que la
+    partida acaba igual. Varias grabaciones sirven de benchmark de extremo a extremo."""
+    total_t = total_k = 0
+    for ruta in rutas:
+        cab, teclas, fin = leer_teclas(ruta)
+        if cab.get("version") != VERSION:
+            print(f"{ruta}: grabada con v{cab.get('version')}, esta es v{VERSION}", file=sys.stderr)
+        with tempfile.TemporaryDirectory() as tmp:
+            save = SaveMgr(Path(tmp))
+            save.importar(cab.get("partidas", {}))
+            ui = VirtualUI(cab["filas"], cab["cols"], teclas)
+            ui.rapido = True
+            game = Game(None, ui, save)
+            random.seed(cab["semilla"])
+            t = time.perf_counter()
+            game.run()
+            t = time.perf_counter() - t
+        huella = GrabadorTeclas.huella(game.p)
+        estado = "sin huella" if fin is None else ("OK" if fin == huella else f"DIVERGE ({fin} != {huella})")
+        print(f"{ruta}: {len(teclas)} teclas  {ui.frames} frames  {t*1000:.0f} ms  "
+              f"({len(teclas)/max(t, 1e-9):.0f} teclas/s)  {estado}")
+        total_t += t; total_k += len(teclas)
+    if len(rutas) > 1:
+        print(f"TOTAL: {total_k} teclas en {total_t*1000:.0f} ms")
+
+def _migrar_fichero(tarea: Tuple[str, bool]) -> dict:
+    """Trabajo de un proceso del pool: conserva formato y compresión del fichero y deja
+    una copia <fichero>.v<esquema>.bak antes de reescribirlo."""
+    ruta, simular = Path(tarea[0]), tarea[1]
+    inf: Dict[str, Any] = {"ruta": str(ruta), "pasos": [], "avisos": []}
+    try:
+        crudo = b"".join(leer_trozos(ruta))
+        plano = descomprimir_trozos([crudo])
+        data = decodificar_partida(plano)
+        if not isinstance(data, dict) or "player" not in data:
+            inf["estado"] = "ignorado"; return inf
+        inf["esquema"] = esquema_partida(data)
+        data, inf["pasos"], inf["avisos"] = migrar_partida(data)
+        inf["estado"] = "migrado" if inf["pasos"] else "al día"
+        if inf["pasos"] and not simular:
+            datos = a_binario(data) if plano[:4] == MAGIA_BIN else json.dumps(data, indent=2).encode("utf-8")
+            comp = compresion_de(crudo)
+            if comp: datos = comprimir_trozos([datos], comp)
+            copia = ruta.with_name(f"{ruta.name}.v{inf['esquema']}.bak")
+            if not copia.exists(): escribir_atomico(copia, crudo)
+            escribir_atomico(ruta, datos)
+    except Exception as e:
+        inf["estado"], inf["error"] = "error", str(e)
+    return inf
+
+def migrar_directorio(raiz: Path, simular: bool = False, procesos: Optional[int] = None):
+    from concurrent.futures import ProcessPoolExecutor
+    rutas = sorted(fp for ext in SaveMgr.EXT.values() for fp in raiz.rglob(f"*{ext}"))
+    if simular: print("(simulación: no se escribe nada)")
+    cuenta: Dict[str, int] = {}
+    origen: Dict[str, int] = {}
+    with ProcessPoolExecutor(procesos) as pool:
+        for inf in pool.map(_migrar_fichero, [(str(r), simular) for r in rutas], chunksize=8):
+            est = inf["estado"]
+            cuenta[est] = cuenta.get(est, 0) + 1
+            if est == "migrado":
+                origen[inf["esquema"]] = origen.get(inf["esquema"], 0) + 1
+                print(f"MIGRADO  {inf['ruta']}  {' | '.join(inf['pasos'])}")
+                for a in inf["avisos"]: print(f"         a extra: {a}")
+            elif est == "error": print(f"ERROR    {inf['ruta']}  {inf['error']}")
+    print(", ".join(f"{k}: {v}" for k, v in sorted(cuenta.items())) or "sin partidas")
+    if origen: print("desde: " + ", ".join(f"{k}: {v}" for k, v in sorted(origen.items())))
+
 def main(scr):
+    # KADATH_TECLAS y KADATH_PERFIL son de la partida en terminal: sesiones --servir,
+    # --repetir y --bench-ansi no deben sobrescribir esos ficheros ni resembrar random
+    game = None
     try:
         game = Game(scr)
-        game.run()
+        game.run(os.environ.get("KADATH_TECLAS"))
     except KeyboardInterrupt:
         pass
     except Exception as e:
@@ -1510,8 +3624,57 @@ def main(scr):
         print(f"\nError: {e}")
         print(STUDIO)
         raise
+    finally:
+        ruta = os.environ.get("KADATH_PERFIL")
+        if ruta and game:
+            try:
+                with open(ruta, "w") as f: json.dump(game.perfil(), f, indent=2)
+            except OSError: pass
 
 if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="KADATH — La Búsqueda Onírica de la Desconocida Kadath")
+    ap.add_argument("--bench-ansi", action="store_true", help="mide bytes por frame del render ANSI")
+    ap.add_argument("--ver-grabacion", metavar="REC", help="reproduce una grabación (KADATH_GRABAR)")
+    ap.add_argument("--exportar-grabacion", metavar="REC", help="exporta el último frame a .txt/.ansi/.html")
+    ap.add_argument("--rapido", action="store_true", help="sin esperas al reproducir")
+    ap.add_argument("--servir", metavar="PUERTO", type=int, help="aloja partidas por telnet (asyncio)")
+    ap.add_argument("--repetir", metavar="TECLAS", nargs="+", help="reproduce sesiones de KADATH_TECLAS sin terminal")
+    ap.add_argument("--exportar-json", metavar="DIR", help="copia las partidas a DIR como JSON legible")
+    ap.add_argument("--ultimas", action="store_true", help="última partida de cada perfil (KADATH_DB)")
+    ap.add_argument("--migrar", metavar="DIR", help=f"actualiza al esquema v{VERSION} todas las partidas de DIR")
+    ap.add_argument("--simular", action="store_true", help="con --migrar: solo informa")
+    ap.add_argument("--procesos", type=int, help="con --migrar: procesos del pool")
+    args = ap.parse_args()
+    if args.migrar:
+        migrar_directorio(Path(args.migrar), args.simular, args.procesos)
+        sys.exit(0)
+    if args.exportar_json:
+        for fp in abrir_partidas().exportar_json(Path(args.exportar_json)): print(fp)
+        sys.exit(0)
+    if args.ultimas:
+        if not os.environ.get("KADATH_DB"): sys.exit("--ultimas necesita KADATH_DB")
+        for nombre, slot, ts, zona, nivel in abrir_partidas().ultimas():
+            print(f"{nombre:24} {slot:8} {ts[:19]}  {ZONAS.get(zona, {}).get('nombre', zona)}  niv.{nivel}")
+        sys.exit(0)
+    if args.repetir:
+        repetir_sesiones(args.repetir)
+        sys.exit(0)
+    if args.servir:
+        try: asyncio.run(servir(args.servir))
+        except KeyboardInterrupt: pass
+        sys.exit(0)
+    if args.bench_ansi:
+        bench_ansi()
+        sys.exit(0)
+    if args.ver_grabacion:
+        ver_grabacion(args.ver_grabacion, args.rapido)
+        sys.exit(0)
+    if args.exportar_grabacion:
+        pan = None
+        for _, pan in leer_grabacion(args.exportar_grabacion): pass
+        if pan: exportar_pantalla(pan, Path(args.exportar_grabacion))
+        sys.exit(0)
     try:
         curses.wrapper(main)
     except KeyboardInterrupt:
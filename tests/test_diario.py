@@ -0,0 +1,34 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import main
+
+
+def _recargar(d: Path) -> main.Player:
+    m = main.SaveMgr(d)
+    p = m.cargar("auto")
+    m.cerrar()
+    return p
+
+
+def test_cola_cortada_y_nuevas_anotaciones(tmp_path):
+    m = main.SaveMgr(tmp_path)
+    p = main.Player()
+    m.guardar(p, "auto", esperar=True)
+    for _ in range(20):
+        p.turno += 1
+        p.oro += 1
+        m.anotar(p)
+    m.cerrar()
+
+    diario = tmp_path / "auto.diario"
+    diario.write_bytes(diario.read_bytes()[:-3])     # caída a mitad del último registro
+    m = main.SaveMgr(tmp_path)
+    p = m.cargar("auto")
+    assert p.oro == 39
+    p.oro += 100
+    m.anotar(p)
+    m.cerrar()
+
+    assert _recargar(tmp_path).oro == 139